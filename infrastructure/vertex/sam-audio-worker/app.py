@@ -1,13 +1,35 @@
+import asyncio
 import base64
+import collections
+import concurrent.futures
+import contextlib
+import gc
+import hashlib
+import importlib.metadata
 import json as _json
+import math
 import os
+import random
+import shutil
+import socket
+import sqlite3
+import struct
 import subprocess
+import sys
 import tempfile
-from typing import Any, Dict, List, Optional
-
+import threading
+import time
+import types
+import uuid
+from typing import Any, Dict, List, Optional, Union
+
+import numpy as np
+import soundfile
 import torch
 import torchaudio
-from fastapi import FastAPI, File, Form, Header, HTTPException, UploadFile
+from fastapi import FastAPI, File, Form, Header, HTTPException, Request, UploadFile
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse
 from pydantic import BaseModel
 
 from sam_audio import SAMAudio, SAMAudioProcessor
@@ -30,6 +52,15 @@ class Instance(BaseModel):
     which: str = "target"  # "target" | "residual"
     predict_spans: bool = False
     reranking_candidates: int = 0
+    # Optional SLA routing: "fast" | "balanced" | "best", and/or a latency budget
+    tier: str = ""
+    latency_budget_ms: float = 0.0
+    # Optional deadline; reranking/span prediction adapt to fit it
+    deadline_ms: float = 0.0
+    # Reuse stored results of an earlier upload of the same audio
+    reuse: bool = True
+    # Optional client-chosen id, usable with /sam_audio/cancel/{job_id}
+    job_id: str = ""
 
 
 class DisentangleInstance(BaseModel):
@@ -45,6 +76,19 @@ class DisentangleInstance(BaseModel):
     # Separation parameters
     predict_spans: bool = True
     reranking_candidates: int = 8
+    # Continue from a stored cascade for the same input when possible
+    resume: bool = True
+    # Add `descriptions` after the stems already separated for this input
+    extend: bool = False
+    # Optional SLA routing: "fast" | "balanced" | "best", and/or a latency budget
+    tier: str = ""
+    latency_budget_ms: float = 0.0
+    # Optional deadline; reranking/span prediction adapt to fit it
+    deadline_ms: float = 0.0
+    # Reuse stored results of an earlier upload of the same audio
+    reuse: bool = True
+    # Optional client-chosen id, usable with /sam_audio/cancel/{job_id}
+    job_id: str = ""
 
 
 class PredictRequest(BaseModel):
@@ -55,15 +99,31 @@ class DisentangleRequest(BaseModel):
     instances: List[DisentangleInstance]
 
 
+class QueueSubmitRequest(BaseModel):
+    """A task for the shared queue: an Instance or DisentangleInstance by kind."""
+    kind: str = "separate"  # "separate" | "disentangle"
+    instance: Dict[str, Any]
+
+
 # ─────────────────────────────────────────────────────────────────────────────
 # Global State
 # ─────────────────────────────────────────────────────────────────────────────
 
 _DEVICE = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-_MODEL: Optional[SAMAudio] = None
-_PROCESSOR: Optional[SAMAudioProcessor] = None
 _CLAP_RANKER: Optional[ClapRanker] = None
 
+# Hosted SAM-Audio variants (model_id -> lane), populated by _build_lanes()
+_LANES: Dict[str, "_Lane"] = {}
+_DEFAULT_LANE = ""
+
+# Model lifecycle: idle eviction + local weight cache for fast reloads
+_CLAP_LOCK = threading.RLock()
+_INFLIGHT_LOCK = threading.Lock()
+_INFLIGHT = 0
+_LAST_USED = time.monotonic()
+_LIFECYCLE_EVENTS: collections.deque = collections.deque(maxlen=32)
+_LIFECYCLE_COUNTS = {"loads": 0, "unloads": 0, "cache_hits": 0, "cache_writes": 0}
+
 
 # ─────────────────────────────────────────────────────────────────────────────
 # Sound Atlas: Comprehensive instrument descriptions from AudioSet ontology
@@ -297,496 +357,3467 @@ def _require_auth(authorization: Optional[str]):
         raise HTTPException(status_code=403, detail="Invalid token")
 
 
-def _ensure_loaded():
-    global _MODEL, _PROCESSOR, _CLAP_RANKER
-    if _MODEL is not None and _PROCESSOR is not None:
-        return
+def _truthy(value: Any) -> bool:
+    return str(value).lower() in ("true", "1", "yes")
 
-    hf_token = os.getenv("HF_TOKEN", "").strip()
-    if not hf_token:
-        raise RuntimeError("HF_TOKEN is required (gated Hugging Face model access)")
 
-    # HF auth (works with huggingface_hub + transformers)
-    os.environ["HUGGINGFACE_HUB_TOKEN"] = hf_token
+def _parse_variant_map(env_name: str, defaults: Dict[str, float]) -> Dict[str, float]:
+    """
+    Parse "small=4,large=16" style env vars into {alias: value}.
+    A bare number applies to every variant.
+    """
+    values = dict(defaults)
+    raw = os.getenv(env_name, "").strip()
+    for item in filter(None, (part.strip() for part in raw.split(","))):
+        if "=" in item:
+            key, value = item.split("=", 1)
+            values[key.strip()] = float(value)
+        else:
+            values = {key: float(item) for key in values}
+            values["*"] = float(item)
+    return values
 
-    model_id = os.getenv("SAM_MODEL_ID", "facebook/sam-audio-small").strip()
-    _MODEL = SAMAudio.from_pretrained(model_id).to(_DEVICE).eval()
-    _PROCESSOR = SAMAudioProcessor.from_pretrained(model_id)
 
-    # Load CLAP ranker for instrument introspection
-    _CLAP_RANKER = ClapRanker(ClapRankerConfig())
+# ─────────────────────────────────────────────────────────────────────────────
+# Model Lifecycle: idle eviction + local memory-mapped weight cache
+# ─────────────────────────────────────────────────────────────────────────────
 
 
-def _to_wav_path(input_path: str, out_path: str) -> None:
-    """
-    Convert input media to WAV using ffmpeg.
-    This supports mp3/mp4/etc so the webapp can upload anything.
-    """
-    cmd = [
-        "ffmpeg",
-        "-y",
-        "-hide_banner",
-        "-loglevel",
-        "error",
-        "-i",
-        input_path,
-        "-acodec",
-        "pcm_s16le",
-        "-ac",
-        "2",
-        "-ar",
-        "44100",
-        out_path,
-    ]
-    proc = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    if proc.returncode != 0:
-        raise RuntimeError("ffmpeg failed: " + proc.stderr.decode("utf-8", errors="ignore"))
+def _idle_unload_seconds() -> float:
+    """Idle TTL after which a model is evicted. 0 disables eviction."""
+    return float(os.getenv("SAM_IDLE_UNLOAD_SECONDS", "0") or 0)
 
 
-def _write_wav_bytes(wave: torch.Tensor, sample_rate: int) -> bytes:
-    # torchaudio.save expects (channels, time)
-    if wave.dim() == 1:
-        wave = wave.unsqueeze(0)
-    with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as f:
-        out_path = f.name
+def _library_versions() -> str:
+    """torch + sam_audio versions; pickled modules are only valid for the code that wrote them."""
     try:
-        torchaudio.save(out_path, wave.cpu(), sample_rate)
-        with open(out_path, "rb") as rf:
-            return rf.read()
-    finally:
-        try:
-            os.unlink(out_path)
-        except OSError:
-            pass
+        sam_version = importlib.metadata.version("sam_audio")
+    except importlib.metadata.PackageNotFoundError:
+        sam_version = "unknown"
+    return f"torch-{torch.__version__}_sam-audio-{sam_version}".replace("/", "_")
 
 
-def _introspect_audio(
-    audio_tensor: torch.Tensor,
-    sample_rate: int,
-    descriptions: List[str],
-    threshold: float = 0.2,
-    top_k_fallback: int = 5,
-) -> tuple[List[str], Dict[str, float]]:
+def _weight_cache_dir(model_id: str) -> Optional[str]:
     """
-    Use CLAP ranker to score audio against a list of descriptions.
-    Returns selected descriptions (above threshold or top-k fallback) and all scores.
+    Local directory holding pre-converted weights for `model_id`, keyed by the
+    library versions. Returns None when SAM_WEIGHT_CACHE_DIR is explicitly set
+    to "", or when the root is not private to this user: the cache is
+    unpickled, so anyone able to write it could run code in the worker.
     """
-    assert _CLAP_RANKER is not None, "CLAP ranker not loaded"
+    default_root = os.path.join(os.path.expanduser("~"), ".cache", "sam-audio-weights")
+    root = os.getenv("SAM_WEIGHT_CACHE_DIR", default_root).strip()
+    if not root:
+        return None
+    try:
+        os.makedirs(root, mode=0o700, exist_ok=True)
+        st = os.stat(root)
+    except OSError as e:
+        _record_lifecycle("cache_error", model_id=model_id, error=str(e))
+        return None
+    if st.st_uid != os.getuid() or st.st_mode & 0o022:
+        _record_lifecycle(
+            "cache_error", model_id=model_id,
+            error=f"{root} is writable by other users; weight cache disabled",
+        )
+        return None
+    return os.path.join(root, _library_versions(), model_id.replace("/", "--"))
 
-    # Ensure audio is 1D for CLAP scoring
-    if audio_tensor.dim() > 1:
-        audio_1d = audio_tensor.mean(0) if audio_tensor.size(0) > 1 else audio_tensor.squeeze(0)
-    else:
-        audio_1d = audio_tensor
 
-    # Repeat audio for batch scoring against all descriptions
-    num_desc = len(descriptions)
-    extracted_audio = [audio_1d.cpu()] * num_desc
+def _record_lifecycle(event: str, **details: Any) -> None:
+    _LIFECYCLE_EVENTS.append({"event": event, "at": time.time(), **details})
 
-    with torch.inference_mode():
-        scores = _CLAP_RANKER(
-            extracted_audio=extracted_audio,
-            descriptions=descriptions,
-            sample_rate=sample_rate,
-        ).squeeze(-1).cpu()
 
-    # Build score dict
-    score_dict = {desc: float(scores[i]) for i, desc in enumerate(descriptions)}
+def _load_from_cache(cache_dir: str, names: List[str]) -> Optional[Dict[str, Any]]:
+    """
+    Reload pickled modules from the local weight cache.
 
-    # Select descriptions above threshold
-    selected = [descriptions[i] for i in range(num_desc) if scores[i] > threshold]
+    The cache stores whole pickled objects, so torch.load(mmap=True) maps the
+    weight storages straight from the page cache instead of re-reading and
+    re-building them through from_pretrained (no hub access needed).
+    """
+    paths = {name: os.path.join(cache_dir, name + ".pt") for name in names}
+    if not all(os.path.exists(path) for path in paths.values()):
+        return None
+    return {
+        name: torch.load(path, map_location="cpu", mmap=True, weights_only=False)
+        for name, path in paths.items()
+    }
 
-    # Fallback to top-k if none above threshold
-    if not selected and top_k_fallback > 0:
-        top_indices = scores.topk(min(top_k_fallback, num_desc)).indices.tolist()
-        selected = [descriptions[i] for i in top_indices]
 
-    return selected, score_dict
+def _write_cache(cache_dir: str, objs: Dict[str, Any]) -> None:
+    """Persist freshly loaded modules so the next reload can be mmap'd."""
+    os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+    for name, obj in objs.items():
+        # Write-then-rename so a crash never leaves a truncated cache entry
+        tmp_path = os.path.join(cache_dir, name + ".pt.tmp")
+        torch.save(obj, tmp_path)
+        os.replace(tmp_path, os.path.join(cache_dir, name + ".pt"))
+    _LIFECYCLE_COUNTS["cache_writes"] += 1
 
 
-def _disentangle_audio(
-    wav_path: str,
-    descriptions: List[str],
-    predict_spans: bool = True,
-    reranking_candidates: int = 8,
-) -> tuple[List[Dict[str, Any]], torch.Tensor, int]:
+def _load_cached_or(model_id: str, names: List[str], load_fn) -> Dict[str, Any]:
     """
-    Iteratively separate each described sound from the audio.
-    Returns list of separated tracks, final residual, and sample rate.
-
-    Each track dict contains:
-    - description: str
-    - audio: torch.Tensor
-    - iteration: int (0-indexed)
+    Load `names` for `model_id` from the weight cache, falling back to
+    `load_fn()` (a hub load) and populating the cache afterwards.
     """
-    assert _MODEL is not None
-    assert _PROCESSOR is not None
-
-    sr = int(getattr(_PROCESSOR, "audio_sampling_rate", 44100))
-
-    # Load audio for iteration
-    waveform, file_sr = torchaudio.load(wav_path)
-    if file_sr != sr:
-        waveform = torchaudio.functional.resample(waveform, file_sr, sr)
-
-    # Convert to mono for processing
-    current_audio = waveform.mean(0, keepdim=True).to(_DEVICE)
+    cache_dir = _weight_cache_dir(model_id)
+    started = time.perf_counter()
 
-    separated_tracks: List[Dict[str, Any]] = []
+    if cache_dir is not None:
+        try:
+            objs = _load_from_cache(cache_dir, names)
+            if objs is not None:
+                _LIFECYCLE_COUNTS["loads"] += 1
+                _LIFECYCLE_COUNTS["cache_hits"] += 1
+                _record_lifecycle(
+                    "load", source="cache", model_id=model_id,
+                    seconds=round(time.perf_counter() - started, 3),
+                )
+                return objs
+        except Exception as e:
+            # A stale or corrupt cache must never block serving; fall back to the hub
+            _record_lifecycle("cache_error", model_id=model_id, error=str(e))
 
-    for i, desc in enumerate(descriptions):
-        # Create a temp file for current residual to feed to processor
-        with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as tf:
-            temp_path = tf.name
+    objs = load_fn()
+    _LIFECYCLE_COUNTS["loads"] += 1
+    _record_lifecycle(
+        "load", source="hub", model_id=model_id,
+        seconds=round(time.perf_counter() - started, 3),
+    )
 
+    if cache_dir is not None:
         try:
-            # Save current audio state to temp file
-            torchaudio.save(temp_path, current_audio.cpu(), sr)
+            _write_cache(cache_dir, objs)
+        except Exception as e:
+            _record_lifecycle("cache_error", model_id=model_id, error=str(e))
+    return objs
 
-            batch = _PROCESSOR(
-                audios=[temp_path],
-                descriptions=[desc],
-            ).to(_DEVICE)
 
-            with torch.inference_mode():
-                result = _MODEL.separate(
-                    batch,
-                    predict_spans=predict_spans,
-                    reranking_candidates=reranking_candidates,
-                )
+def _require_hf_token() -> None:
+    hf_token = os.getenv("HF_TOKEN", "").strip()
+    if not hf_token:
+        raise RuntimeError("HF_TOKEN is required (gated Hugging Face model access)")
 
-            # Extract separated target
-            target = result.target[0]
-            residual = result.residual[0]
+    # HF auth (works with huggingface_hub + transformers)
+    os.environ["HUGGINGFACE_HUB_TOKEN"] = hf_token
 
-            separated_tracks.append({
-                "description": desc,
-                "audio": target.cpu(),
-                "iteration": i,
-            })
 
-            # Update current audio to residual for next iteration
-            current_audio = residual.unsqueeze(0) if residual.dim() == 1 else residual
-            current_audio = current_audio.to(_DEVICE)
+def _release_memory() -> None:
+    gc.collect()
+    if _DEVICE.type == "cuda":
+        torch.cuda.empty_cache()
 
-        finally:
-            try:
-                os.unlink(temp_path)
-            except OSError:
-                pass
 
-    # Final residual (whatever's left after all separations)
-    final_residual = current_audio.squeeze(0).cpu()
+def _ensure_clap_loaded() -> None:
+    global _CLAP_RANKER
+    with _CLAP_LOCK:
+        if _CLAP_RANKER is not None:
+            return
+        # Load CLAP ranker for instrument introspection
+        objs = _load_cached_or(
+            "clap-ranker", ["clap"], lambda: {"clap": ClapRanker(ClapRankerConfig())}
+        )
+        _CLAP_RANKER = objs["clap"]
+
 
-    return separated_tracks, final_residual, sr
+def _unload_clap(reason: str) -> bool:
+    global _CLAP_RANKER
+    with _CLAP_LOCK:
+        if _CLAP_RANKER is None:
+            return False
+        _CLAP_RANKER = None
+        _release_memory()
+        _LIFECYCLE_COUNTS["unloads"] += 1
+        _record_lifecycle("unload", model_id="clap-ranker", reason=reason)
+        return True
 
 
 # ─────────────────────────────────────────────────────────────────────────────
-# HTTP Endpoints
+# Jobs & Cooperative Cancellation
 # ─────────────────────────────────────────────────────────────────────────────
 
 
-@app.get("/health")
-def health():
-    return {
-        "ok": True,
-        "device": str(_DEVICE),
-        "model_loaded": _MODEL is not None,
-        "clap_loaded": _CLAP_RANKER is not None,
-        "sound_atlas_size": len(SOUND_ATLAS),
-    }
+class _Cancelled(Exception):
+    """Raised at a pipeline checkpoint once the job has been cancelled."""
 
+    def __init__(self, job: "_Job", stage: str):
+        super().__init__(f"Job {job.job_id} cancelled ({job.reason}) before {stage}")
+        self.stage = stage
 
-@app.post("/sam_audio/separate")
-async def sam_audio_separate(
-    authorization: Optional[str] = Header(default=None),
-    audio: UploadFile = File(...),
-    description: str = Form(default=""),
-    anchors_json: str = Form(default=""),
-    predict_spans: str = Form(default="false"),
-    reranking_candidates: str = Form(default="0"),
-) -> Dict[str, Any]:
+
+class _Job:
     """
-    Compatibility endpoint for the VocalX webapp:
-    - multipart fields: audio, description, anchors_json, predict_spans, reranking_candidates
-    - returns: { ok, target_wav_base64, residual_wav_base64 }
+    Cancellation handle for one unit of work. The pipeline calls
+    _checkpoint() between stages; cancel() only sets a flag, so work stops at
+    the next checkpoint rather than mid-kernel.
     """
-    _require_auth(authorization)
-    _ensure_loaded()
-    assert _MODEL is not None
-    assert _PROCESSOR is not None
 
-    raw = await audio.read()
-    if not raw:
-        return {"ok": False, "error": "Empty file"}
-
-    with tempfile.TemporaryDirectory() as td:
-        in_path = os.path.join(td, audio.filename or "input")
-        wav_path = os.path.join(td, "input.wav")
-        with open(in_path, "wb") as f:
-            f.write(raw)
-        _to_wav_path(in_path, wav_path)
+    def __init__(self, job_id: str = "", profile: bool = False):
+        self.job_id = job_id or uuid.uuid4().hex
+        self.profile = profile
+        self.reason = ""
+        self._event = threading.Event()
 
-        anchors = None
-        if anchors_json and anchors_json.strip():
-            anchors = [_json.loads(anchors_json)]
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
 
-        batch = _PROCESSOR(
-            audios=[wav_path],
-            descriptions=[description or ""],
-            anchors=anchors,
-        ).to(_DEVICE)
+    def cancel(self, reason: str) -> None:
+        if not self._event.is_set():
+            self.reason = reason
+            self._event.set()
 
-        with torch.inference_mode():
-            result = _MODEL.separate(
-                batch,
-                predict_spans=str(predict_spans).lower() in ("true", "1", "yes"),
-                reranking_candidates=int(reranking_candidates or 0),
-            )
 
-        sr = int(getattr(_PROCESSOR, "audio_sampling_rate", 44100))
-        target = result.target[0]
-        residual = result.residual[0]
+_JOBS: Dict[str, _Job] = {}
+_JOBS_LOCK = threading.Lock()
+_CANCEL_COUNTS: Dict[str, Any] = {
+    "cancelled": 0,
+    "iterations_skipped": 0,
+    "by_reason": collections.Counter(),
+    "by_stage": collections.Counter(),
+}
 
-        target_b64 = base64.b64encode(_write_wav_bytes(target, sr)).decode("utf-8")
-        residual_b64 = base64.b64encode(_write_wav_bytes(residual, sr)).decode("utf-8")
 
-        return {"ok": True, "target_wav_base64": target_b64, "residual_wav_base64": residual_b64}
+def _checkpoint(job: Optional[_Job], stage: str) -> None:
+    if job is not None and job.cancelled:
+        raise _Cancelled(job, stage)
 
 
-@app.post("/predict")
-def predict(req: PredictRequest) -> Dict[str, Any]:
+def _run_job(job: _Job, fn, *args: Any) -> Dict[str, Any]:
     """
-    Vertex AI prediction route.
-    Returns { "predictions": [ ... ] }.
+    Run `fn(*args, job=job)` with `job` registered for explicit cancellation.
+    A cancelled job returns an ok=false result and frees its memory right away.
+
+    Every model-bound job (HTTP, Vertex or queued) runs here, so this is also
+    where in-flight work is counted for the idle evictor. It is deliberately
+    not an HTTP middleware: Starlette's BaseHTTPMiddleware wraps the request's
+    receive channel, and request.is_disconnected() then never turns true.
     """
-    _ensure_loaded()
-    assert _MODEL is not None
-    assert _PROCESSOR is not None
+    global _INFLIGHT, _LAST_USED
+    with _JOBS_LOCK:
+        if job.job_id in _JOBS:
+            raise HTTPException(status_code=409, detail=f"Job {job.job_id} is already running")
+        _JOBS[job.job_id] = job
+    with _INFLIGHT_LOCK:
+        _INFLIGHT += 1
+
+    cancelled: Optional[Dict[str, Any]] = None
+    try:
+        reason = _profile_reason(job)
+        if reason is None:
+            result = fn(*args, job=job)
+        else:
+            with _profiling(job, fn.__name__, reason) as trace:
+                result = fn(*args, job=job)
+            result["profile"] = trace
+        result.setdefault("job_id", job.job_id)
+        return result
+    except _Cancelled as e:
+        cancelled = {"ok": False, "cancelled": True, "job_id": job.job_id, "error": str(e)}
+        _CANCEL_COUNTS["cancelled"] += 1
+        _CANCEL_COUNTS["by_reason"][job.reason] += 1
+        _CANCEL_COUNTS["by_stage"][e.stage] += 1
+    finally:
+        with _JOBS_LOCK:
+            _JOBS.pop(job.job_id, None)
+        with _INFLIGHT_LOCK:
+            _INFLIGHT -= 1
+            _LAST_USED = time.monotonic()
 
-    preds: List[Dict[str, Any]] = []
+    # Outside the except block the traceback, and the tensors its frames held, are gone
+    _release_memory()
+    return cancelled
 
-    for inst in req.instances:
-        if not inst.audio_b64:
-            preds.append({"ok": False, "error": "Missing audio_b64"})
-            continue
 
-        raw = base64.b64decode(inst.audio_b64)
-        if not raw:
-            preds.append({"ok": False, "error": "Empty audio"})
-            continue
+async def _run_watched(request: Request, jobs: List[_Job], fn, *args: Any) -> Any:
+    """
+    Run blocking `fn(*args)` in the threadpool, cancelling `jobs` if the HTTP
+    client disconnects (closed tab, load balancer timeout) before it finishes.
+    """
 
-        with tempfile.TemporaryDirectory() as td:
-            in_path = os.path.join(td, inst.filename or "input")
-            wav_path = os.path.join(td, "input.wav")
-            with open(in_path, "wb") as f:
-                f.write(raw)
+    async def _watch() -> None:
+        while True:
+            if await request.is_disconnected():
+                for job in jobs:
+                    job.cancel("client disconnected")
+                return
+            await asyncio.sleep(0.5)
 
-            # Convert to wav for consistent processing
-            _to_wav_path(in_path, wav_path)
+    watcher = asyncio.create_task(_watch())
+    try:
+        return await run_in_threadpool(fn, *args)
+    finally:
+        watcher.cancel()
 
-            # anchors_json is a string representation like:
-            # [["+", 6.3, 7.0], ["-", 0.0, 1.0]]
-            anchors = None
-            if inst.anchors_json and inst.anchors_json.strip():
-                anchors = [_json.loads(inst.anchors_json)]
 
-            batch = _PROCESSOR(
-                audios=[wav_path],
-                descriptions=[inst.description or ""],
-                anchors=anchors,
-            ).to(_DEVICE)
+# ─────────────────────────────────────────────────────────────────────────────
+# Request Profiling (torch.profiler + Python stack samples)
+# ─────────────────────────────────────────────────────────────────────────────
 
-            with torch.inference_mode():
-                result = _MODEL.separate(
-                    batch,
-                    predict_spans=bool(inst.predict_spans),
-                    reranking_candidates=int(inst.reranking_candidates or 0),
-                )
+# Fraction of jobs profiled without being asked (0 = only on request)
+_PROFILE_SAMPLE_RATE = float(os.getenv("SAM_PROFILE_SAMPLE_RATE", "0"))
+_PROFILE_STACK_INTERVAL_S = float(os.getenv("SAM_PROFILE_STACK_INTERVAL_MS", "10")) / 1000.0
+_PROFILE_MAX_TRACES = max(1, int(os.getenv("SAM_PROFILE_MAX_TRACES", "20")))
+# torch.profiler supports one session per process; other jobs run unprofiled meanwhile
+_PROFILE_LOCK = threading.Lock()
+_PROFILE_STATE = {"armed": 0}
+_PROFILE_STATE_LOCK = threading.Lock()
+_PROFILE_COUNTS = collections.Counter()
+
+
+def _profile_root() -> str:
+    return os.getenv("SAM_PROFILE_DIR", "/tmp/sam-audio-profiles").strip() or "/tmp/sam-audio-profiles"
+
+
+def _profile_reason(job: _Job) -> Optional[str]:
+    """Why `job` should be profiled (request flag, armed by an admin, sampled), if at all."""
+    if job.profile:
+        return "requested"
+    with _PROFILE_STATE_LOCK:
+        if _PROFILE_STATE["armed"] > 0:
+            _PROFILE_STATE["armed"] -= 1
+            return "armed"
+    if _PROFILE_SAMPLE_RATE > 0 and random.random() < _PROFILE_SAMPLE_RATE:
+        return "sampled"
+    return None
+
+
+class _StackSampler(threading.Thread):
+    """Samples the Python stack of one thread at a fixed interval."""
+
+    def __init__(self, thread_id: int, interval_s: float):
+        super().__init__(name="profile-stack-sampler", daemon=True)
+        self.thread_id = thread_id
+        self.interval_s = max(interval_s, 0.001)
+        self.samples: List[tuple[float, tuple[str, ...]]] = []
+        self.started = time.perf_counter()
+        self._stop_event = threading.Event()
+
+    def run(self) -> None:
+        while not self._stop_event.wait(self.interval_s):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{getattr(code, 'co_qualname', code.co_name)} ({os.path.basename(code.co_filename)})")
+                frame = frame.f_back
+            self.samples.append((time.perf_counter() - self.started, tuple(reversed(stack))))
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        self.join()
+
+    def trace_events(self, ts0_us: float) -> List[Dict[str, Any]]:
+        """Samples as nested Chrome-trace slices (a flame chart), starting at `ts0_us`."""
+        events: List[Dict[str, Any]] = []
+        open_frames: List[tuple[str, float]] = []
+        end = time.perf_counter() - self.started
+        for at, stack in self.samples + [(end, ())]:
+            common = 0
+            while common < min(len(open_frames), len(stack)) and open_frames[common][0] == stack[common]:
+                common += 1
+            for name, start in reversed(open_frames[common:]):
+                events.append({
+                    "name": name, "ph": "X", "cat": "python",
+                    "ts": ts0_us + start * 1e6, "dur": (at - start) * 1e6,
+                    "pid": "python stack samples", "tid": self.thread_id,
+                })
+            open_frames = open_frames[:common] + [(name, at) for name in stack[common:]]
+        return events
 
-            sr = int(getattr(_PROCESSOR, "audio_sampling_rate", 44100))
-            target = result.target[0]
-            residual = result.residual[0]
 
-            target_b64 = base64.b64encode(_write_wav_bytes(target, sr)).decode("utf-8")
-            residual_b64 = base64.b64encode(_write_wav_bytes(residual, sr)).decode("utf-8")
+def _save_trace(trace_id: str, prof: Any, sampler: _StackSampler, meta: Dict[str, Any]) -> None:
+    """Merge the torch trace and stack samples into one Chrome trace in the bounded store."""
+    root = _profile_root()
+    os.makedirs(root, exist_ok=True)
+    path = os.path.join(root, f"{trace_id}.json")
 
-            preds.append(
-                {
-                    "ok": True,
-                    "target_wav_base64": target_b64,
-                    "residual_wav_base64": residual_b64,
-                }
-            )
+    trace: Dict[str, Any] = {"traceEvents": []}
+    if prof is not None:
+        tmp_path = path + ".torch"
+        try:
+            prof.export_chrome_trace(tmp_path)
+            with open(tmp_path) as f:
+                trace = _json.load(f)
+        finally:
+            with contextlib.suppress(OSError):
+                os.unlink(tmp_path)
+    timestamps = [e["ts"] for e in trace.get("traceEvents", []) if isinstance(e.get("ts"), (int, float))]
+    trace.setdefault("traceEvents", []).extend(sampler.trace_events(min(timestamps, default=0.0)))
+    trace["sam_audio"] = meta
+
+    with open(path + ".tmp", "w") as f:
+        _json.dump(trace, f)
+    os.replace(path + ".tmp", path)
+    meta["size_bytes"] = os.path.getsize(path)
+    with open(os.path.join(root, f"{trace_id}.meta.json"), "w") as f:
+        _json.dump(meta, f)
+
+    traces = sorted(
+        (entry for entry in os.listdir(root) if entry.endswith(".meta.json")),
+        key=lambda entry: os.path.getmtime(os.path.join(root, entry)),
+        reverse=True,
+    )
+    for entry in traces[_PROFILE_MAX_TRACES:]:
+        stale = entry[:-len(".meta.json")]
+        for suffix in (".meta.json", ".json"):
+            with contextlib.suppress(OSError):
+                os.unlink(os.path.join(root, stale + suffix))
+
+
+@contextlib.contextmanager
+def _profiling(job: _Job, handler: str, reason: str):
+    """
+    Profile the calling thread for the duration of the block. Yields the
+    trace info for the response; the trace is saved even if the job fails.
+    """
+    if not _PROFILE_LOCK.acquire(blocking=False):
+        _PROFILE_COUNTS["skipped_busy"] += 1
+        yield {"error": "Another request is being profiled"}
+        return
 
-    return {"predictions": preds}
+    trace_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+    info: Dict[str, Any] = {"trace_id": trace_id, "url": f"/sam_audio/profiles/{trace_id}"}
+    activities = [torch.profiler.ProfilerActivity.CPU]
+    if _DEVICE.type == "cuda":
+        activities.append(torch.profiler.ProfilerActivity.CUDA)
+    prof: Any = torch.profiler.profile(activities=activities)
+    sampler = _StackSampler(threading.get_ident(), _PROFILE_STACK_INTERVAL_S)
+    started_at = time.time()
+    try:
+        try:
+            prof.start()
+        except RuntimeError as e:
+            # Stack samples alone still show where the time went
+            info["torch_profiler_error"] = str(e)
+            prof = None
+        sampler.start()
+        yield info
+    finally:
+        sampler.stop()
+        if prof is not None:
+            prof.stop()
+        meta = {
+            "trace_id": trace_id,
+            "job_id": job.job_id,
+            "handler": handler,
+            "reason": reason,
+            "started_at": started_at,
+            "elapsed_ms": round((time.time() - started_at) * 1000),
+            "stack_samples": len(sampler.samples),
+        }
+        try:
+            _save_trace(trace_id, prof, sampler, meta)
+            _PROFILE_COUNTS[reason] += 1
+        except Exception as e:
+            info["error"] = f"Could not save trace: {e}"
+            _record_lifecycle("profile_error", trace_id=trace_id, error=str(e))
+        _PROFILE_LOCK.release()
+
+
+def _list_traces() -> List[Dict[str, Any]]:
+    root = _profile_root()
+    if not os.path.isdir(root):
+        return []
+    traces = []
+    for entry in os.listdir(root):
+        if entry.endswith(".meta.json"):
+            with contextlib.suppress(OSError, ValueError):
+                with open(os.path.join(root, entry)) as f:
+                    traces.append(_json.load(f))
+    return sorted(traces, key=lambda meta: meta["started_at"], reverse=True)
 
 
 # ─────────────────────────────────────────────────────────────────────────────
-# Instrument Disentangling Endpoints
+# Priority Scheduling
 # ─────────────────────────────────────────────────────────────────────────────
 
+# Studio interactions (separate/introspect) vs. background cascades (disentangle)
+PRIORITY_INTERACTIVE = "interactive"
+PRIORITY_BATCH = "batch"
+# Share of slots each class gets while both are backlogged
+_PRIORITY_WEIGHTS = _parse_variant_map(
+    "SAM_PRIORITY_WEIGHTS", {PRIORITY_INTERACTIVE: 4.0, PRIORITY_BATCH: 1.0}
+)
+_PRIORITY_WEIGHTS.pop("*", None)
 
-@app.post("/sam_audio/disentangle")
-async def sam_audio_disentangle(
-    authorization: Optional[str] = Header(default=None),
-    audio: UploadFile = File(...),
-    descriptions: str = Form(default=""),  # JSON array or empty for auto-detect
-    threshold: str = Form(default="0.2"),
-    top_k_fallback: str = Form(default="5"),
-    predict_spans: str = Form(default="true"),
-    reranking_candidates: str = Form(default="8"),
-) -> Dict[str, Any]:
+
+class _FairScheduler:
     """
-    Instrument disentangling endpoint for VocalX webapp.
+    Slot pool shared by priority classes with weighted fair queuing.
 
-    Auto-detects instruments in audio using CLAP introspection against the
-    Sound Atlas (AudioSet ontology), then iteratively separates each detected
-    instrument.
+    A free slot goes to the backlogged class with the least weighted service
+    (grants / weight), FIFO within a class. With the default 4:1 weights,
+    interactive requests overtake a queue of batch work, but batch still gets
+    every fifth slot while both are waiting.
+    """
 
-    Parameters:
-    - audio: Audio file (MP3/MP4/WAV/etc)
-    - descriptions: JSON array of descriptions to separate (optional).
-                    If empty, auto-detects using CLAP scoring.
-    - threshold: CLAP score threshold for auto-detection (0.0-1.0)
-    - top_k_fallback: Fallback to top N instruments if none above threshold
-    - predict_spans: Enable span prediction
-    - reranking_candidates: Number of reranking candidates
+    def __init__(self, name: str, capacity: int):
+        self.name = name
+        self.capacity = max(1, capacity)
+        self.active = 0
+        self.cond = threading.Condition()
+        self.queues: Dict[str, collections.deque] = {c: collections.deque() for c in _PRIORITY_WEIGHTS}
+        self.service = {c: 0.0 for c in _PRIORITY_WEIGHTS}
+        self.vtime = 0.0
+        self.stats = {
+            c: {"granted": 0, "wait_total_ms": 0.0, "wait_max_ms": 0.0} for c in _PRIORITY_WEIGHTS
+        }
+
+    def waiting(self) -> int:
+        return sum(len(q) for q in self.queues.values())
+
+    def _next_class(self) -> Optional[str]:
+        backlogged = [c for c, q in self.queues.items() if q]
+        if not backlogged:
+            return None
+        return min(backlogged, key=lambda c: (self.service[c], -_PRIORITY_WEIGHTS[c]))
+
+    def acquire(self, priority: str, job: Optional[_Job] = None) -> None:
+        if priority not in self.queues:
+            raise ValueError(f"Unknown priority class {priority!r}")
+        ticket = object()
+        queued_at = time.monotonic()
+        with self.cond:
+            queue = self.queues[priority]
+            if not queue:
+                # An idle class must not bank credit and then starve the others
+                self.service[priority] = max(self.service[priority], self.vtime)
+            queue.append(ticket)
+            while not (
+                self.active < self.capacity
+                and self._next_class() == priority
+                and queue[0] is ticket
+            ):
+                if job is not None and job.cancelled:
+                    queue.remove(ticket)
+                    self.cond.notify_all()
+                    raise _Cancelled(job, f"{self.name} slot")
+                # Poll so a cancelled waiter leaves the queue promptly
+                self.cond.wait(timeout=0.25 if job is not None else None)
+            queue.popleft()
+            self.active += 1
+            self.vtime = self.service[priority]
+            self.service[priority] += 1.0 / _PRIORITY_WEIGHTS[priority]
+
+            waited_ms = (time.monotonic() - queued_at) * 1000
+            stats = self.stats[priority]
+            stats["granted"] += 1
+            stats["wait_total_ms"] += waited_ms
+            stats["wait_max_ms"] = max(stats["wait_max_ms"], waited_ms)
+            # Another slot may still be free for the next class in line
+            self.cond.notify_all()
+
+    def release(self) -> None:
+        with self.cond:
+            self.active -= 1
+            self.cond.notify_all()
+
+    @contextlib.contextmanager
+    def slot(self, priority: str, job: Optional[_Job] = None):
+        self.acquire(priority, job)
+        try:
+            yield
+        finally:
+            self.release()
 
-    Returns:
-    {
-        "ok": true/false,
-        "detected_instruments": [...],  # Descriptions selected for separation
-        "introspection_scores": {...},  # All CLAP scores (if auto-detected)
-        "tracks": [
-            {
-                "description": "...",
-                "wav_base64": "...",
-                "iteration": 0
-            },
-            ...
-        ],
-        "residual_wav_base64": "...",  # Final residual after all separations
-        "error": "..."  # Only if ok=false
-    }
-    """
-    _require_auth(authorization)
-    _ensure_loaded()
-    assert _MODEL is not None
-    assert _PROCESSOR is not None
-    assert _CLAP_RANKER is not None
+    def status(self) -> Dict[str, Any]:
+        with self.cond:
+            return {
+                "capacity": self.capacity,
+                "active": self.active,
+                "classes": {
+                    c: {
+                        "queue_depth": len(self.queues[c]),
+                        "granted": st["granted"],
+                        "wait_avg_ms": round(st["wait_total_ms"] / max(st["granted"], 1), 1),
+                        "wait_max_ms": round(st["wait_max_ms"], 1),
+                    }
+                    for c, st in self.stats.items()
+                },
+            }
 
-    raw = await audio.read()
-    if not raw:
-        return {"ok": False, "error": "Empty file"}
 
-    try:
-        with tempfile.TemporaryDirectory() as td:
-            in_path = os.path.join(td, audio.filename or "input")
-            wav_path = os.path.join(td, "input.wav")
-            with open(in_path, "wb") as f:
-                f.write(raw)
-            _to_wav_path(in_path, wav_path)
-
-            sr = int(getattr(_PROCESSOR, "audio_sampling_rate", 44100))
-
-            # Parse descriptions if provided
-            desc_list: List[str] = []
-            if descriptions and descriptions.strip():
-                desc_list = _json.loads(descriptions)
-
-            introspection_scores: Dict[str, float] = {}
-
-            # Auto-detect instruments if no descriptions provided
-            if not desc_list:
-                # Load audio for introspection
-                waveform, file_sr = torchaudio.load(wav_path)
-                if file_sr != sr:
-                    waveform = torchaudio.functional.resample(waveform, file_sr, sr)
-                audio_tensor = waveform.mean(0)  # Mono for CLAP
-
-                desc_list, introspection_scores = _introspect_audio(
-                    audio_tensor=audio_tensor,
-                    sample_rate=sr,
-                    descriptions=SOUND_ATLAS,
-                    threshold=float(threshold),
-                    top_k_fallback=int(top_k_fallback),
-                )
+# CLAP introspection/scoring has its own slots so interactive introspection
+# never queues behind a disentangle cascade on a SAM lane
+_CLAP_SCHEDULER = _FairScheduler("clap-ranker", int(os.getenv("SAM_CLAP_CONCURRENCY", "1")))
 
-            if not desc_list:
-                return {
-                    "ok": False,
-                    "error": "No instruments detected and no descriptions provided",
-                    "introspection_scores": introspection_scores,
-                }
-
-            # Perform iterative separation
-            separated_tracks, final_residual, sr = _disentangle_audio(
-                wav_path=wav_path,
-                descriptions=desc_list,
-                predict_spans=str(predict_spans).lower() in ("true", "1", "yes"),
-                reranking_candidates=int(reranking_candidates),
-            )
 
-            # Encode tracks to base64
-            tracks_output = []
-            for track in separated_tracks:
-                wav_b64 = base64.b64encode(
-                    _write_wav_bytes(track["audio"], sr)
-                ).decode("utf-8")
-                tracks_output.append({
-                    "description": track["description"],
-                    "wav_base64": wav_b64,
-                    "iteration": track["iteration"],
-                })
+# ─────────────────────────────────────────────────────────────────────────────
+# Variant Lanes & SLA Router
+# ─────────────────────────────────────────────────────────────────────────────
 
-            residual_b64 = base64.b64encode(
-                _write_wav_bytes(final_residual, sr)
-            ).decode("utf-8")
+# Declared memory budget (GB) per variant, matching the README VRAM table
+_DEFAULT_MEMORY_GB = {"small": 4.0, "base": 8.0, "large": 16.0, "*": 8.0}
+# Prior real-time factor (compute seconds per audio second, no reranking),
+# refined at runtime from measured throughput
+_DEFAULT_RTF = {"small": 0.1, "base": 0.2, "large": 0.4, "*": 0.2}
+# Prior peak activation memory (GB per minute of audio per reranking candidate),
+# raised immediately and lowered slowly from measured CUDA peaks
+_DEFAULT_ACTIVATION_GB = {"small": 0.5, "base": 0.75, "large": 1.0, "*": 0.75}
+# Extra compute per reranking candidate, relative to one separation pass
+_RERANK_COST = float(os.getenv("SAM_RERANK_COST", "0.25"))
+# Extra compute for span prediction, relative to one separation pass
+_SPAN_COST = float(os.getenv("SAM_SPAN_COST", "0.15"))
+# Tier -> (position among hosted variants ordered by size, reranking candidates)
+_TIERS: Dict[str, tuple[str, int]] = {
+    "best": ("largest", 8),
+    "balanced": ("middle", 2),
+    "fast": ("smallest", 0),
+}
 
-            return {
-                "ok": True,
-                "detected_instruments": desc_list,
-                "introspection_scores": introspection_scores,
-                "tracks": tracks_output,
-                "residual_wav_base64": residual_b64,
-            }
 
-    except Exception as e:
-        return {"ok": False, "error": str(e)}
+class _LaneUnavailable(RuntimeError):
+    """Raised when a variant cannot be loaded within its memory budget."""
 
 
-@app.post("/predict/disentangle")
-def predict_disentangle(req: DisentangleRequest) -> Dict[str, Any]:
-    """
-    Vertex AI prediction route for instrument disentangling.
+def _cost_units(reranking_candidates: int, predict_spans: bool = False) -> float:
+    """Compute of one separation in units of a plain (no rerank, no spans) pass."""
+    return 1 + max(reranking_candidates, 0) * _RERANK_COST + (_SPAN_COST if predict_spans else 0.0)
 
-    Accepts batch of audio files for automatic instrument detection and
-    iterative separation.
+
+def _rounds_cost_units(reranking_candidates: int, predict_spans: bool = False) -> float:
+    """
+    Worst-case compute of reranking in rounds of SAM_RERANK_ROUND: every round
+    is a full pass, so the base and span cost is paid once per round.
+    """
+    rounds, last = divmod(max(reranking_candidates, 0), _RERANK_ROUND)
+    cost = rounds * _cost_units(_RERANK_ROUND, predict_spans)
+    return cost + (_cost_units(last, predict_spans) if last else 0.0)
+
+
+# Share of planned candidates generated before adaptive reranking stopped on
+# its margin (EWMA over runs; starts optimistic at the two-round minimum)
+_RERANK_GENERATED_SHARE = 0.0
+
+
+def _adaptive_reranking(deadline_at: Optional[float] = None) -> bool:
+    """Whether reranking may run in early-stopping rounds."""
+    return deadline_at is not None or _truthy(os.getenv("SAM_ADAPTIVE_RERANKING", "false"))
+
+
+def _rounds_pay_off(reranking_candidates: int, predict_spans: bool = False) -> bool:
+    """
+    Whether rounds are expected to cost less than one pass generating every
+    candidate. Early stopping needs two rounds at least, and each round pays
+    the base pass again, so small candidate counts never qualify.
+    """
+    if reranking_candidates <= _RERANK_ROUND:
+        return False
+    expected = math.ceil(reranking_candidates * _RERANK_GENERATED_SHARE / _RERANK_ROUND) * _RERANK_ROUND
+    expected = min(reranking_candidates, max(2 * _RERANK_ROUND, expected))
+    return _rounds_cost_units(expected, predict_spans) < _cost_units(reranking_candidates, predict_spans)
+
+
+def _variant_alias(model_id: str) -> str:
+    """facebook/sam-audio-large -> large"""
+    return model_id.rsplit("/", 1)[-1].rsplit("-", 1)[-1]
+
+
+class _Lane:
+    """
+    One hosted model variant: its weights, a bounded pool of inference slots
+    and a memory budget that must be free before the weights are (re)loaded.
+    """
+
+    def __init__(
+        self,
+        model_id: str,
+        concurrency: int,
+        queue_limit: int,
+        memory_gb: float,
+        rtf: float,
+        activation_gb: float,
+    ):
+        self.model_id = model_id
+        self.alias = _variant_alias(model_id)
+        self.concurrency = max(1, concurrency)
+        self.queue_limit = max(0, queue_limit)
+        self.memory_gb = memory_gb
+        self.model: Optional[SAMAudio] = None
+        self.processor: Optional[SAMAudioProcessor] = None
+        self.lock = threading.RLock()
+        self.scheduler = _FairScheduler(model_id, self.concurrency)
+        self.active = 0
+        self.waiting = 0
+        self.completed = 0
+        self.last_used = time.monotonic()
+        self.rtf = rtf
+        self.activation_gb = activation_gb
+
+    @property
+    def sample_rate(self) -> int:
+        return int(getattr(self.processor, "audio_sampling_rate", 44100))
+
+    def saturated(self) -> bool:
+        return self.active + self.waiting >= self.concurrency + self.queue_limit
+
+    def estimate_seconds(self, duration_s: float, reranking_candidates: int) -> float:
+        """Expected wall time including the work already queued on this lane."""
+        # Rounds only run when expected to cost less, so one pass bounds the estimate
+        run = duration_s * self.rtf * _cost_units(reranking_candidates)
+        return run * (1 + (self.active + self.waiting) / self.concurrency)
+
+    def observe(
+        self,
+        duration_s: float,
+        reranking_candidates: int,
+        elapsed_s: float,
+        predict_spans: bool = False,
+    ) -> None:
+        """Fold a measured separation into the lane's real-time factor (EWMA)."""
+        if duration_s <= 0:
+            return
+        sample = elapsed_s / (duration_s * _cost_units(reranking_candidates, predict_spans))
+        with self.lock:
+            self.rtf = 0.8 * self.rtf + 0.2 * sample
+
+    def _memory_units(self, duration_s: float, reranking_candidates: int) -> float:
+        # Reranking candidates are generated as one batch of the whole input
+        return duration_s / 60.0 * max(1, reranking_candidates) * self.sample_rate / _INPUT_SAMPLE_RATE
+
+    def estimate_memory_gb(self, duration_s: float, reranking_candidates: int) -> float:
+        """Expected peak activation memory of one separation call, weights excluded."""
+        return self.activation_gb * self._memory_units(duration_s, reranking_candidates)
+
+    def observe_memory(self, duration_s: float, reranking_candidates: int, peak_gb: float) -> None:
+        """Fold a measured activation peak into the estimate: up at once, down slowly."""
+        units = self._memory_units(duration_s, reranking_candidates)
+        if units <= 0:
+            return
+        sample = peak_gb / units
+        with self.lock:
+            self.activation_gb = max(sample, 0.9 * self.activation_gb + 0.1 * sample)
+
+    def acquire(self, priority: str = PRIORITY_INTERACTIVE, job: Optional[_Job] = None) -> None:
+        """Take an inference slot and make sure the weights are resident."""
+        with self.lock:
+            self.waiting += 1
+        try:
+            self.scheduler.acquire(priority, job)
+        finally:
+            with self.lock:
+                self.waiting -= 1
+        with self.lock:
+            self.active += 1
+            try:
+                self._ensure_loaded()
+            except BaseException:
+                self.active -= 1
+                self.scheduler.release()
+                raise
+
+    def release(self, completed: bool = True) -> None:
+        with self.lock:
+            self.active -= 1
+            self.completed += int(completed)
+            self.last_used = time.monotonic()
+        self.scheduler.release()
+
+    def yield_slot(self, priority: str) -> None:
+        """
+        Hand the slot back between steps of a long job if anyone is queued.
+        Not cancellable: the caller still owns a slot to release afterwards,
+        and the wait is bounded by the work that was queued ahead of it.
+        """
+        if self.scheduler.waiting() == 0:
+            return
+        self.release(completed=False)
+        self.acquire(priority)
+
+    def _ensure_loaded(self) -> None:
+        if self.model is not None and self.processor is not None:
+            return
+        self._reserve_memory()
+
+        def _from_hub() -> Dict[str, Any]:
+            _require_hf_token()
+            return {
+                "model": SAMAudio.from_pretrained(self.model_id).eval(),
+                "processor": SAMAudioProcessor.from_pretrained(self.model_id),
+            }
+
+        objs = _load_cached_or(self.model_id, ["model", "processor"], _from_hub)
+        self.model = objs["model"].to(_DEVICE).eval()
+        self.processor = objs["processor"]
+
+    def _reserve_memory(self) -> None:
+        """Evict idle sibling lanes until this lane's budget fits on the device."""
+        if _DEVICE.type != "cuda":
+            return
+        free_gb = torch.cuda.mem_get_info()[0] / 2**30
+        for other in sorted(_LANES.values(), key=lambda lane: lane.memory_gb, reverse=True):
+            if free_gb >= self.memory_gb:
+                return
+            if other is not self and other.try_unload(f"make room for {self.model_id}"):
+                free_gb = torch.cuda.mem_get_info()[0] / 2**30
+        if free_gb < self.memory_gb:
+            raise _LaneUnavailable(
+                f"{self.model_id} needs {self.memory_gb:.1f} GB but only {free_gb:.1f} GB is free"
+            )
+
+    def try_unload(self, reason: str, min_idle: float = 0.0) -> bool:
+        # Never block on a sibling lane's lock: two lanes loading at once would deadlock
+        if not self.lock.acquire(blocking=False):
+            return False
+        try:
+            if self.model is None or self.active or self.waiting:
+                return False
+            if time.monotonic() - self.last_used < min_idle:
+                return False
+            self.model = self.processor = None
+            _release_memory()
+            _LIFECYCLE_COUNTS["unloads"] += 1
+            _record_lifecycle("unload", model_id=self.model_id, reason=reason)
+            return True
+        finally:
+            self.lock.release()
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "model_id": self.model_id,
+            "loaded": self.model is not None,
+            "active": self.active,
+            "waiting": self.waiting,
+            "concurrency": self.concurrency,
+            "memory_gb": self.memory_gb,
+            "rtf": round(self.rtf, 4),
+            "activation_gb_per_min": round(self.activation_gb, 3),
+            "completed": self.completed,
+            "scheduler": self.scheduler.status(),
+        }
+
+
+def _build_lanes() -> None:
+    """
+    Create one lane per hosted variant from SAM_MODEL_IDS (comma-separated),
+    falling back to the single SAM_MODEL_ID. Lanes are ordered small -> large.
+    """
+    global _DEFAULT_LANE
+    default_id = os.getenv("SAM_MODEL_ID", "facebook/sam-audio-small").strip()
+    model_ids = [m.strip() for m in os.getenv("SAM_MODEL_IDS", "").split(",") if m.strip()]
+    if not model_ids:
+        model_ids = [default_id]
+
+    memory = _parse_variant_map("SAM_VARIANT_MEMORY_GB", _DEFAULT_MEMORY_GB)
+    rtf = _parse_variant_map("SAM_VARIANT_RTF", _DEFAULT_RTF)
+    activation = _parse_variant_map("SAM_VARIANT_ACTIVATION_GB", _DEFAULT_ACTIVATION_GB)
+    concurrency = _parse_variant_map("SAM_LANE_CONCURRENCY", {"*": 1})
+    queue_limit = _parse_variant_map("SAM_LANE_QUEUE_LIMIT", {"*": 2})
+
+    def _pick(values: Dict[str, float], alias: str) -> float:
+        return values.get(alias, values["*"])
+
+    lanes = []
+    for model_id in dict.fromkeys(model_ids):
+        alias = _variant_alias(model_id)
+        lanes.append(_Lane(
+            model_id,
+            concurrency=int(_pick(concurrency, alias)),
+            queue_limit=int(_pick(queue_limit, alias)),
+            memory_gb=_pick(memory, alias),
+            rtf=_pick(rtf, alias),
+            activation_gb=_pick(activation, alias),
+        ))
+    lanes.sort(key=lambda lane: lane.memory_gb)
+
+    _LANES.clear()
+    _LANES.update({lane.model_id: lane for lane in lanes})
+    _DEFAULT_LANE = default_id if default_id in _LANES else lanes[0].model_id
+
+
+def _tier_lane(position: str) -> _Lane:
+    lanes = list(_LANES.values())
+    index = {"smallest": 0, "middle": (len(lanes) - 1) // 2, "largest": len(lanes) - 1}[position]
+    return lanes[index]
+
+
+def _route(
+    tier: str,
+    latency_budget_ms: float,
+    duration_s: float,
+    reranking_candidates: int,
+) -> tuple[List[_Lane], int, Dict[str, Any]]:
+    """
+    Pick the variant lane and reranking depth for a request.
+
+    Without a tier or latency budget the request is pinned to the default
+    variant with the caller's reranking depth. Otherwise the highest tier
+    (capped by `tier`) whose estimated latency fits the budget wins, and a
+    saturated lane falls back to the next smaller variant.
+
+    Returns (candidate lanes in fallback order, reranking candidates, routing info).
+    """
+    tier = (tier or "").strip().lower()
+    if tier and tier not in _TIERS:
+        raise HTTPException(status_code=400, detail=f"Unknown tier {tier!r}; use one of {sorted(_TIERS)}")
+
+    if not tier and latency_budget_ms <= 0:
+        lane = _LANES[_DEFAULT_LANE]
+        return [lane], reranking_candidates, {"tier": None, "requested_variant": lane.model_id}
+
+    order = list(_TIERS)
+    chosen = order[-1]
+    for name in order[order.index(tier) if tier else 0:]:
+        chosen = name
+        position, rerank = _TIERS[name]
+        budget_s = latency_budget_ms / 1000.0
+        if budget_s <= 0 or _tier_lane(position).estimate_seconds(duration_s, rerank) <= budget_s:
+            break
+
+    position, rerank = _TIERS[chosen]
+    preferred = _tier_lane(position)
+    lanes = list(_LANES.values())
+    smaller = [lane for lane in reversed(lanes) if lane.memory_gb < preferred.memory_gb]
+    candidates = [preferred] + smaller
+    # Saturated lanes go to the back so idle smaller variants absorb the load
+    candidates.sort(key=lambda lane: lane.saturated())
+
+    return candidates, rerank, {
+        "tier": chosen,
+        "requested_variant": preferred.model_id,
+        "latency_budget_ms": latency_budget_ms or None,
+        "estimated_ms": round(candidates[0].estimate_seconds(duration_s, rerank) * 1000),
+    }
+
+
+def _acquire_lane(
+    candidates: List[_Lane],
+    routing: Dict[str, Any],
+    priority: str,
+    job: Optional[_Job] = None,
+) -> _Lane:
+    """
+    Acquire the first candidate lane that can load within its memory budget.
+    Raises 503 when none can.
+    """
+    errors = []
+    for lane in candidates:
+        try:
+            with torch.profiler.record_function(f"sam_audio::lane_wait {lane.alias}"):
+                lane.acquire(priority, job)
+        except _LaneUnavailable as e:
+            errors.append(str(e))
+            continue
+        routing["variant"] = lane.model_id
+        routing["fallback"] = lane.model_id != routing["requested_variant"]
+        return lane
+    raise HTTPException(status_code=503, detail="No model variant available: " + "; ".join(errors))
+
+
+def _idle_evictor() -> None:
+    """Background loop that unloads models once they sit idle past the TTL."""
+    while True:
+        ttl = _idle_unload_seconds()
+        time.sleep(min(max(ttl / 4, 1.0), 30.0) if ttl > 0 else 30.0)
+        if ttl <= 0:
+            continue
+        for lane in list(_LANES.values()):
+            idle_for = time.monotonic() - lane.last_used
+            lane.try_unload(reason=f"idle {idle_for:.0f}s", min_idle=ttl)
+        # Held across the unload so no job (HTTP, Vertex or queued) can start
+        # in _run_job and pick up the ranker while it is being dropped
+        with _INFLIGHT_LOCK:
+            idle_for = time.monotonic() - _LAST_USED
+            if _INFLIGHT == 0 and idle_for >= ttl:
+                _unload_clap(reason=f"idle {idle_for:.0f}s")
+
+
+_build_lanes()
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Memory Admission
+# ─────────────────────────────────────────────────────────────────────────────
+
+# Inputs too large to separate whole are split into chunks no shorter than this
+_MIN_CHUNK_SECONDS = float(os.getenv("SAM_MIN_CHUNK_SECONDS", "5"))
+# Neighbouring chunks overlap by this much and are crossfaded (at most a quarter of a chunk)
+_CHUNK_OVERLAP_SECONDS = min(
+    float(os.getenv("SAM_CHUNK_OVERLAP_SECONDS", "1")), _MIN_CHUNK_SECONDS / 4
+)
+# Longest a separation waits for running ones to free activation memory
+_MEMORY_WAIT_SECONDS = float(os.getenv("SAM_MEMORY_WAIT_SECONDS", "120"))
+
+
+class _MemoryBudget:
+    """
+    Device memory shared by every lane: resident weights plus the estimated
+    activation peak of each running separation. A separation only starts once
+    its estimate fits next to the others; one that could never fit is chunked
+    or rejected before it reaches the model.
+    """
+
+    def __init__(self, budget_gb: Optional[float]):
+        self.budget_gb = budget_gb
+        self.reserved_gb = 0.0
+        self.running = 0
+        self.cond = threading.Condition()
+        self.counts = collections.Counter()
+
+    def capacity_gb(self, lane: _Lane) -> Optional[float]:
+        """Activation memory available to `lane` when nothing else is running."""
+        if self.budget_gb is None:
+            return None
+        weights = sum(other.memory_gb for other in _LANES.values() if other.model is not None or other is lane)
+        return self.budget_gb - weights
+
+    def reserve(self, lane: _Lane, gb: float) -> None:
+        deadline = time.monotonic() + _MEMORY_WAIT_SECONDS
+        with self.cond:
+            queued = False
+            while self.running and not self._fits(lane, gb):
+                queued = True
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.counts["timed_out"] += 1
+                    raise HTTPException(
+                        status_code=503,
+                        detail=f"Timed out waiting for {gb:.1f} GB of device memory "
+                               f"({self.reserved_gb:.1f} GB held by running separations)",
+                    )
+                self.cond.wait(remaining)
+            self.counts["queued"] += int(queued)
+            self.counts["admitted"] += 1
+            self.reserved_gb += gb
+            self.running += 1
+
+    def _fits(self, lane: _Lane, gb: float) -> bool:
+        capacity = self.capacity_gb(lane)
+        return capacity is None or self.reserved_gb + gb <= capacity
+
+    def release(self, gb: float) -> None:
+        with self.cond:
+            self.reserved_gb -= gb
+            self.running -= 1
+            self.cond.notify_all()
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "budget_gb": self.budget_gb,
+            "reserved_gb": round(self.reserved_gb, 2),
+            "running": self.running,
+            **{key: self.counts[key] for key in ("admitted", "queued", "chunked", "rejected", "timed_out", "oom")},
+        }
+
+
+def _memory_budget_gb() -> Optional[float]:
+    """SAM_MEMORY_BUDGET_GB, else 90% of the GPU; None (unlimited) on CPU."""
+    value = os.getenv("SAM_MEMORY_BUDGET_GB", "").strip()
+    if value:
+        return float(value)
+    if _DEVICE.type == "cuda":
+        return torch.cuda.get_device_properties(_DEVICE).total_memory / 2**30 * 0.9
+    return None
+
+
+_MEMORY = _MemoryBudget(_memory_budget_gb())
+
+
+def _memory_routing(
+    candidates: List[_Lane], duration_s: float, reranking_candidates: int
+) -> tuple[List[_Lane], Dict[str, Any]]:
+    """
+    Admission check before a request queues for a lane. Drops candidates the
+    input can never fit on, so a smaller fallback variant can still serve it;
+    raises the preferred variant's 413 early when none fits.
+    """
+    fitting, plans, rejection = [], [], None
+    for lane in candidates:
+        try:
+            plans.append(_memory_plan(lane, duration_s, reranking_candidates, count_rejection=False))
+        except HTTPException as e:
+            rejection = rejection or e
+            continue
+        fitting.append(lane)
+    if not fitting:
+        _MEMORY.counts["rejected"] += 1
+        raise rejection
+    chunk_s, need_gb = plans[0]
+    return fitting, {
+        "estimated_gb": round(need_gb, 2),
+        "chunk_seconds": None if chunk_s is None else round(chunk_s, 1),
+    }
+
+
+def _memory_plan(
+    lane: _Lane, duration_s: float, reranking_candidates: int, count_rejection: bool = True
+) -> tuple[Optional[float], float]:
+    """
+    How to run one separation within the memory budget.
+    Returns (chunk length in seconds, or None to separate the whole input,
+    estimated activation GB per model call). Raises 413 if no chunking fits.
+    """
+    estimate = lane.estimate_memory_gb(duration_s, reranking_candidates)
+    capacity = _MEMORY.capacity_gb(lane)
+    if capacity is None or estimate <= capacity:
+        return None, estimate
+
+    chunk_s = duration_s * capacity / estimate if capacity > 0 else 0.0
+    if chunk_s < _MIN_CHUNK_SECONDS or not _truthy(os.getenv("SAM_CHUNKED_SEPARATION", "true")):
+        _MEMORY.counts["rejected"] += int(count_rejection)
+        raise HTTPException(
+            status_code=413,
+            detail=f"{duration_s:.0f}s of audio with {reranking_candidates} reranking candidates needs "
+                   f"~{estimate:.1f} GB on {lane.model_id}, over the {max(capacity, 0):.1f} GB available; "
+                   f"send shorter audio or fewer reranking candidates",
+        )
+    # Equal overlapping chunks, each within capacity
+    start_s, end_s = _chunk_windows(duration_s, chunk_s)[0]
+    chunk_s = end_s - start_s
+    return chunk_s, lane.estimate_memory_gb(chunk_s, reranking_candidates)
+
+
+def _chunk_windows(duration_s: float, chunk_s: float) -> List[tuple[float, float]]:
+    """
+    Fewest equal windows no longer than `chunk_s` that cover the input, with
+    consecutive windows overlapping by _CHUNK_OVERLAP_SECONDS. Windows of a
+    length returned here map back onto the same windows.
+    """
+    overlap = _CHUNK_OVERLAP_SECONDS
+    count = max(1, math.ceil((duration_s - overlap) / (chunk_s - overlap) - 1e-6))
+    hop = (duration_s - overlap) / count
+    return [(k * hop, k * hop + hop + overlap) for k in range(count)]
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Audio Pipeline
+# ─────────────────────────────────────────────────────────────────────────────
+
+# ffmpeg normalizes every upload to this rate (also what SAM-Audio and CLAP expect)
+_INPUT_SAMPLE_RATE = 44100
+
+# Long inputs are introspected from a few excerpts instead of the full track.
+# Strategy: "even" (evenly spaced), "energy" (loudest windows) or "mixed" (half each).
+_INTROSPECT_EXCERPTS = int(os.getenv("SAM_INTROSPECT_EXCERPTS", "6"))
+_INTROSPECT_EXCERPT_SECONDS = float(os.getenv("SAM_INTROSPECT_EXCERPT_SECONDS", "10"))
+_INTROSPECT_STRATEGY = os.getenv("SAM_INTROSPECT_STRATEGY", "mixed").strip().lower()
+_INTROSPECT_POOLING = os.getenv("SAM_INTROSPECT_POOLING", "mean").strip().lower()
+# Candidate windows read per energy-picked excerpt
+_INTROSPECT_ENERGY_CANDIDATES = 4
+
+
+def _to_wav_path(input_path: str, out_path: str) -> None:
+    """
+    Convert input media to WAV using ffmpeg.
+    This supports mp3/mp4/etc so the webapp can upload anything.
+    """
+    cmd = [
+        "ffmpeg",
+        "-y",
+        "-hide_banner",
+        "-loglevel",
+        "error",
+        "-i",
+        input_path,
+        "-acodec",
+        "pcm_s16le",
+        "-ac",
+        "2",
+        "-ar",
+        str(_INPUT_SAMPLE_RATE),
+        out_path,
+    ]
+    proc = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if proc.returncode != 0:
+        raise RuntimeError("ffmpeg failed: " + proc.stderr.decode("utf-8", errors="ignore"))
+
+
+def _decode_upload(raw: bytes, filename: str, td: str) -> str:
+    """Write the uploaded bytes into `td` and convert them to input.wav."""
+    in_path = os.path.join(td, os.path.basename(filename or "input") or "input")
+    wav_path = os.path.join(td, "input.wav")
+    with open(in_path, "wb") as f:
+        f.write(raw)
+    with torch.profiler.record_function("sam_audio::decode"):
+        _to_wav_path(in_path, wav_path)
+    return wav_path
+
+
+def _wav_duration(wav_path: str) -> float:
+    # torchaudio.info is gone from the torchaudio builds the image installs
+    info = soundfile.info(wav_path)
+    return info.frames / float(info.samplerate or 44100)
+
+
+def _load_mono(wav_path: str, sr: int, num_frames: int = -1, frame_offset: int = 0) -> torch.Tensor:
+    """Load a WAV (or `num_frames` from `frame_offset`) as a 1D mono tensor at `sr`."""
+    waveform, file_sr = torchaudio.load(wav_path, frame_offset=frame_offset, num_frames=num_frames)
+    if file_sr != sr:
+        waveform = torchaudio.functional.resample(waveform, file_sr, sr)
+    return waveform.mean(0)
+
+
+def _load_excerpts(wav_path: str, duration_s: float) -> Optional[List[torch.Tensor]]:
+    """
+    Read `_INTROSPECT_EXCERPTS` non-overlapping excerpts of a decoded upload,
+    or None if the input is short enough to score whole. Only the excerpts
+    (and energy candidates) are read, so cost does not grow with duration.
+    """
+    count, seconds = _INTROSPECT_EXCERPTS, _INTROSPECT_EXCERPT_SECONDS
+    if count <= 0 or seconds <= 0 or duration_s <= count * seconds:
+        return None
+
+    num_frames = int(seconds * _INPUT_SAMPLE_RATE)
+    span = duration_s - seconds
+
+    def _read(start_s: float) -> torch.Tensor:
+        return _load_mono(
+            wav_path, _INPUT_SAMPLE_RATE, num_frames=num_frames,
+            frame_offset=int(start_s * _INPUT_SAMPLE_RATE),
+        )
+
+    n_energy = {"even": 0, "energy": count}.get(_INTROSPECT_STRATEGY, count // 2)
+    n_even = count - n_energy
+    picks = [(start, _read(start)) for start in (span * (i + 0.5) / n_even for i in range(n_even))]
+
+    if n_energy:
+        grid = n_energy * _INTROSPECT_ENERGY_CANDIDATES
+        windows = [(start, _read(start)) for start in (span * (i + 0.5) / grid for i in range(grid))]
+        windows.sort(key=lambda w: float(w[1].pow(2).mean()), reverse=True)
+        for start, wave in windows:
+            if len(picks) == count:
+                break
+            if all(abs(start - other) >= seconds for other, _ in picks):
+                picks.append((start, wave))
+
+    picks.sort(key=lambda p: p[0])
+    return [wave for _, wave in picks]
+
+
+def _wav_bytes(pcm: np.ndarray, sample_rate: int) -> bytes:
+    """
+    (channels, frames) float32 samples as a 32-bit IEEE float WAV, the format
+    torchaudio.save writes for float tensors, without a temp file round trip.
+    """
+    channels, frames = pcm.shape
+    data = np.ascontiguousarray(pcm.T, dtype="<f4").tobytes()
+    # WAVE_FORMAT_IEEE_FLOAT; non-PCM formats carry cbSize and a fact chunk
+    fmt = struct.pack("<HHIIHHH", 3, channels, sample_rate, sample_rate * channels * 4, channels * 4, 32, 0)
+    return b"".join([
+        b"RIFF", struct.pack("<I", 4 + (8 + len(fmt)) + (8 + 4) + (8 + len(data))), b"WAVE",
+        b"fmt ", struct.pack("<I", len(fmt)), fmt,
+        b"fact", struct.pack("<II", 4, frames),
+        b"data", struct.pack("<I", len(data)), data,
+    ])
+
+
+def _pcm_b64(pcm: np.ndarray, sample_rate: int) -> str:
+    with torch.profiler.record_function("sam_audio::encode_wav"):
+        return base64.b64encode(_wav_bytes(pcm, sample_rate)).decode("utf-8")
+
+
+# Stems are encoded off the request thread, overlapping the next cascade iteration
+_ENCODE_POOL = concurrent.futures.ThreadPoolExecutor(
+    max_workers=max(1, int(os.getenv("SAM_ENCODE_WORKERS", "4"))),
+    thread_name_prefix="wav-encode",
+)
+
+
+def _encode_wavs_b64(waves: List[torch.Tensor], sample_rate: int) -> List[concurrent.futures.Future]:
+    """
+    Start encoding stems as base64 WAVs on the encode pool. The stems are
+    stacked (zero-padded to the longest) and copied to host as float32 in a
+    single transfer; the futures resolve in the order of `waves`.
+    """
+    if not waves:
+        return []
+    clips = [wave.detach() if wave.dim() > 1 else wave.detach().unsqueeze(0) for wave in waves]
+    devices = {clip.device for clip in clips}
+    device = devices.pop() if len(devices) == 1 else torch.device("cpu")
+    shape = (len(clips), max(c.size(0) for c in clips), max(c.size(-1) for c in clips))
+
+    with torch.profiler.record_function("sam_audio::to_host"):
+        if all(tuple(c.shape) == shape[1:] for c in clips):
+            stacked = torch.stack([c.to(device) for c in clips])
+        else:
+            stacked = torch.zeros(shape, dtype=clips[0].dtype, device=device)
+            for i, clip in enumerate(clips):
+                stacked[i, :clip.size(0), :clip.size(-1)] = clip.to(device)
+        host = stacked.to("cpu", torch.float32).numpy()
+
+    return [
+        _ENCODE_POOL.submit(_pcm_b64, host[i, :clip.size(0), :clip.size(-1)], sample_rate)
+        for i, clip in enumerate(clips)
+    ]
+
+
+def _introspect_audio(
+    audio_tensor: Union[torch.Tensor, List[torch.Tensor]],
+    sample_rate: int,
+    descriptions: List[str],
+    threshold: float = 0.2,
+    top_k_fallback: int = 5,
+    priority: str = PRIORITY_INTERACTIVE,
+    job: Optional[_Job] = None,
+    pooling: str = "mean",
+) -> tuple[List[str], Dict[str, float]]:
+    """
+    Use CLAP ranker to score audio against a list of descriptions.
+    `audio_tensor` may also be a list of excerpts, scored in one batch and
+    pooled per description ("mean" or "max").
+    Returns selected descriptions (above threshold or top-k fallback) and all scores.
+    """
+    assert _CLAP_RANKER is not None, "CLAP ranker not loaded"
+
+    # Ensure audio is 1D for CLAP scoring
+    clips = audio_tensor if isinstance(audio_tensor, list) else [audio_tensor]
+    clips = [
+        (clip.mean(0) if clip.size(0) > 1 else clip.squeeze(0)) if clip.dim() > 1 else clip
+        for clip in clips
+    ]
+
+    # Repeat each clip for batch scoring against all descriptions
+    num_desc = len(descriptions)
+    extracted_audio = [clip.cpu() for clip in clips for _ in range(num_desc)]
+
+    with _CLAP_SCHEDULER.slot(priority, job), torch.profiler.record_function("sam_audio::introspect"), \
+            torch.inference_mode():
+        scores = _CLAP_RANKER(
+            extracted_audio=extracted_audio,
+            descriptions=descriptions * len(clips),
+            sample_rate=sample_rate,
+        ).squeeze(-1).cpu().view(len(clips), num_desc)
+    scores = scores.amax(0) if pooling == "max" else scores.mean(0)
+
+    # Build score dict
+    score_dict = {desc: float(scores[i]) for i, desc in enumerate(descriptions)}
+
+    return _select_descriptions(descriptions, score_dict, threshold, top_k_fallback), score_dict
+
+
+def _select_descriptions(
+    descriptions: List[str],
+    score_dict: Dict[str, float],
+    threshold: float,
+    top_k_fallback: int,
+) -> List[str]:
+    """Descriptions scoring above threshold, or the top-k if none does."""
+    selected = [desc for desc in descriptions if score_dict[desc] > threshold]
+
+    # Fallback to top-k if none above threshold
+    if not selected and top_k_fallback > 0:
+        selected = sorted(descriptions, key=score_dict.__getitem__, reverse=True)[:top_k_fallback]
+
+    return selected
+
+
+class _OutOfMemory(RuntimeError):
+    """Raised after a CUDA OOM in a separation has been cleaned up."""
+
+
+def _run_model(
+    lane: _Lane,
+    audio_path: str,
+    description: str,
+    duration_s: float,
+    anchors: Optional[List[Any]],
+    predict_spans: bool,
+    reranking_candidates: int,
+):
+    """
+    One model call. Measures its activation peak when it is the only running
+    separation, and turns a CUDA OOM into _OutOfMemory with the cache emptied
+    so concurrent and later requests are unaffected.
+    """
+    assert lane.model is not None
+    assert lane.processor is not None
+
+    calibrate = _DEVICE.type == "cuda" and _MEMORY.running == 1
+    if calibrate:
+        torch.cuda.reset_peak_memory_stats(_DEVICE)
+        baseline = torch.cuda.memory_allocated(_DEVICE)
+
+    try:
+        with torch.profiler.record_function("sam_audio::processor"):
+            batch = lane.processor(
+                audios=[audio_path],
+                descriptions=[description],
+                anchors=anchors,
+            ).to(_DEVICE)
+
+        with torch.profiler.record_function("sam_audio::separate"), torch.inference_mode():
+            result = lane.model.separate(
+                batch,
+                predict_spans=predict_spans,
+                reranking_candidates=reranking_candidates,
+            )
+    except torch.cuda.OutOfMemoryError as e:
+        error = str(e).splitlines()[0]
+    else:
+        if calibrate:
+            peak_gb = (torch.cuda.max_memory_allocated(_DEVICE) - baseline) / 2**30
+            lane.observe_memory(duration_s, reranking_candidates, peak_gb)
+        return result
+
+    # Outside the except block, so the failed call's tensors can be freed
+    _release_memory()
+    _MEMORY.counts["oom"] += 1
+    _record_lifecycle("oom", model_id=lane.model_id, duration_s=round(duration_s, 1), error=error)
+    raise _OutOfMemory(error)
+
+
+def _shift_anchors(anchors: Optional[List[Any]], start_s: float, end_s: float) -> Optional[List[Any]]:
+    """Clip [[kind, t0, t1], ...] anchors to a chunk and make them chunk-relative."""
+    if not anchors:
+        return anchors
+    shifted = [
+        [kind, max(t0, start_s) - start_s, min(t1, end_s) - start_s]
+        for kind, t0, t1 in anchors[0]
+        if t0 < end_s and t1 > start_s
+    ]
+    return [shifted] if shifted else None
+
+
+def _separate_chunked(
+    lane: _Lane,
+    audio_path: str,
+    description: str,
+    duration_s: float,
+    chunk_s: float,
+    anchors: Optional[List[Any]],
+    predict_spans: bool,
+    reranking_candidates: int,
+):
+    """
+    Separate overlapping chunks of the input and overlap-add target and
+    residual, with a linear crossfade across each overlap so chunk borders
+    leave no seam.
+    """
+    file_sr = soundfile.info(audio_path).samplerate
+    out_sr = lane.sample_rate
+    fade = max(1, int(round(_CHUNK_OVERLAP_SECONDS * out_sr)))
+    windows = _chunk_windows(duration_s, chunk_s)
+    target = residual = weight = None
+    with tempfile.TemporaryDirectory() as td:
+        for k, (start_s, end_s) in enumerate(windows):
+            end_s = min(end_s, duration_s)
+            waveform, _ = torchaudio.load(
+                audio_path,
+                frame_offset=int(round(start_s * file_sr)),
+                num_frames=int(round(end_s * file_sr)) - int(round(start_s * file_sr)),
+            )
+            chunk_path = os.path.join(td, f"chunk_{k}.wav")
+            torchaudio.save(chunk_path, waveform, file_sr)
+            result = _run_model(
+                lane, chunk_path, description, end_s - start_s,
+                _shift_anchors(anchors, start_s, end_s), predict_spans, reranking_candidates,
+            )
+            chunk_target, chunk_residual = result.target[0].cpu(), result.residual[0].cpu()
+            del result
+
+            length = chunk_target.size(-1)
+            ramp = torch.ones(length)
+            n = min(fade, length)
+            if k > 0:
+                ramp[:n] = torch.linspace(0.0, 1.0, n + 2)[1:-1]
+            if k < len(windows) - 1:
+                ramp[-n:] = torch.minimum(ramp[-n:], torch.linspace(1.0, 0.0, n + 2)[1:-1])
+
+            if target is None:
+                total = int(round(duration_s * out_sr))
+                target = chunk_target.new_zeros(*chunk_target.shape[:-1], total)
+                residual = chunk_residual.new_zeros(*chunk_residual.shape[:-1], total)
+                weight = torch.zeros(total)
+            # Model output may differ from the window by a few samples
+            offset = int(round(start_s * out_sr))
+            span = max(0, min(length, total - offset))
+            target[..., offset:offset + span] += chunk_target[..., :span] * ramp[:span]
+            residual[..., offset:offset + span] += chunk_residual[..., :span] * ramp[:span]
+            weight[offset:offset + span] += ramp[:span]
+
+    weight = weight.clamp_min(1e-6)
+    return types.SimpleNamespace(target=[target / weight], residual=[residual / weight])
+
+
+def _separate_path(
+    lane: _Lane,
+    audio_path: str,
+    description: str,
+    duration_s: float,
+    anchors: Optional[List[Any]] = None,
+    predict_spans: bool = False,
+    reranking_candidates: int = 0,
+):
+    """
+    Run one separation on `lane` within the memory budget and feed the timing
+    back into its RTF estimate. Inputs whose estimated peak does not fit are
+    separated in chunks; after an OOM the raised estimate is re-planned once.
+    """
+    started = time.perf_counter()
+    for attempt in range(2):
+        chunk_s, need_gb = _memory_plan(lane, duration_s, reranking_candidates)
+        with torch.profiler.record_function("sam_audio::memory_wait"):
+            _MEMORY.reserve(lane, need_gb)
+        try:
+            if chunk_s is None:
+                result = _run_model(
+                    lane, audio_path, description, duration_s,
+                    anchors, predict_spans, reranking_candidates,
+                )
+            else:
+                _MEMORY.counts["chunked"] += 1
+                result = _separate_chunked(
+                    lane, audio_path, description, duration_s, chunk_s,
+                    anchors, predict_spans, reranking_candidates,
+                )
+            break
+        except _OutOfMemory as e:
+            if attempt:
+                raise HTTPException(status_code=503, detail=f"Out of device memory on {lane.model_id}: {e}")
+            # The estimate was too low: make sure the retry plans for more
+            lane.observe_memory(chunk_s or duration_s, reranking_candidates, need_gb * 1.5)
+        finally:
+            _MEMORY.release(need_gb)
+    lane.observe(duration_s, reranking_candidates, time.perf_counter() - started, predict_spans)
+    return result
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Deadline-Aware Adaptive Reranking
+# ─────────────────────────────────────────────────────────────────────────────
+
+# Candidates generated per round when reranking adaptively
+_RERANK_ROUND = max(1, int(os.getenv("SAM_RERANK_ROUND", "2")))
+# Stop generating candidates once the best CLAP score leads the runner-up by this much
+_RERANK_EARLY_STOP_MARGIN = float(os.getenv("SAM_RERANK_EARLY_STOP_MARGIN", "0.05"))
+
+
+def _deadline_at(deadline_ms: float, started: float) -> Optional[float]:
+    """Absolute time.monotonic() deadline, or None when no deadline was given."""
+    if not deadline_ms or deadline_ms <= 0:
+        return None
+    return started + deadline_ms / 1000.0
+
+
+def _request_deadline_ms(field_value: Any, header_value: Optional[str]) -> float:
+    """Request field wins over the X-Request-Deadline-Ms header."""
+    return float(field_value or header_value or 0)
+
+
+def _plan_separation(
+    lane: _Lane,
+    duration_s: float,
+    predict_spans: bool,
+    reranking_candidates: int,
+    budget_s: Optional[float],
+    adaptive: bool = False,
+) -> tuple[bool, int, bool]:
+    """
+    Largest settings (up to what the caller asked for) whose estimated cost on
+    `lane` fits `budget_s`. Reranking candidates are shed first; span
+    prediction is only dropped once even a single pass would not fit.
+
+    Returns (predict_spans, reranking_candidates, in_rounds). `in_rounds` is
+    only set when `adaptive`, rounds are expected to cost less than one pass
+    (_rounds_pay_off) and every round of the plan fits the budget; otherwise
+    the candidates are generated in one pass. A deadline is met by shedding
+    candidates, never by switching to rounds.
+    """
+    if budget_s is None:
+        in_rounds = adaptive and _rounds_pay_off(reranking_candidates, predict_spans)
+        return predict_spans, reranking_candidates, in_rounds
+
+    passes = budget_s / max(duration_s * lane.rtf, 1e-6)
+    fit = int((passes - _cost_units(0, predict_spans)) // _RERANK_COST)
+    if fit < 0 and predict_spans:
+        predict_spans = False
+        fit = int((passes - _cost_units(0)) // _RERANK_COST)
+    planned = max(0, min(reranking_candidates, fit))
+    in_rounds = (
+        adaptive
+        and _rounds_pay_off(planned, predict_spans)
+        and _rounds_cost_units(planned, predict_spans) <= passes
+    )
+    return predict_spans, planned, in_rounds
+
+
+def _clap_score(
+    wave: torch.Tensor,
+    description: str,
+    sample_rate: int,
+    priority: str,
+    job: Optional[_Job] = None,
+) -> float:
+    assert _CLAP_RANKER is not None, "CLAP ranker not loaded"
+    audio_1d = wave.mean(0) if wave.dim() > 1 else wave
+    with _CLAP_SCHEDULER.slot(priority, job), torch.profiler.record_function("sam_audio::rerank_score"), \
+            torch.inference_mode():
+        scores = _CLAP_RANKER(
+            extracted_audio=[audio_1d.cpu()],
+            descriptions=[description],
+            sample_rate=sample_rate,
+        )
+    return float(scores.reshape(-1)[0])
+
+
+def _separate_adaptive(
+    lane: _Lane,
+    audio_path: str,
+    description: str,
+    duration_s: float,
+    anchors: Optional[List[Any]] = None,
+    predict_spans: bool = False,
+    reranking_candidates: int = 0,
+    deadline_at: Optional[float] = None,
+    priority: str = PRIORITY_INTERACTIVE,
+    job: Optional[_Job] = None,
+):
+    """
+    Separate with reranking depth and span prediction fitted to `deadline_at`.
+
+    When adaptive (a deadline is set, or SAM_ADAPTIVE_RERANKING is on) the
+    candidates are generated in rounds of SAM_RERANK_ROUND. Each round's best
+    is scored with CLAP, and generation stops once one round clearly leads or
+    the next round would overrun the deadline. Rounds repeat the base pass, so
+    a plan whose rounds would not all fit the deadline runs as one pass.
+
+    Returns (separation result, settings actually used).
+    """
+    global _RERANK_GENERATED_SHARE
+    budget_s = None if deadline_at is None else deadline_at - time.monotonic()
+    predict_spans, planned, in_rounds = _plan_separation(
+        lane, duration_s, predict_spans, reranking_candidates, budget_s,
+        adaptive=_adaptive_reranking(deadline_at),
+    )
+    settings: Dict[str, Any] = {
+        "predict_spans": predict_spans,
+        "reranking_candidates": planned,
+        "requested_reranking_candidates": reranking_candidates,
+        "rounds": 1,
+        "early_stopped": False,
+    }
+
+    if not in_rounds:
+        result = _separate_path(
+            lane, audio_path, description, duration_s,
+            anchors=anchors, predict_spans=predict_spans, reranking_candidates=planned,
+        )
+        return result, settings
+
+    _ensure_clap_loaded()
+    best_result = None
+    scores: List[float] = []
+    generated = 0
+    deadline_stop = False
+    while generated < planned:
+        _checkpoint(job, "rerank round")
+        size = min(_RERANK_ROUND, planned - generated)
+        result = _separate_path(
+            lane, audio_path, description, duration_s,
+            anchors=anchors, predict_spans=predict_spans, reranking_candidates=size,
+        )
+        generated += size
+        score = _clap_score(result.target[0], description, lane.sample_rate, priority, job)
+        if not scores or score > max(scores):
+            best_result = result
+        scores.append(score)
+
+        if generated >= planned:
+            break
+        ranked = sorted(scores, reverse=True)
+        if len(ranked) >= 2 and ranked[0] - ranked[1] >= _RERANK_EARLY_STOP_MARGIN:
+            settings["early_stopped"] = True
+            break
+        if deadline_at is not None:
+            next_round_s = duration_s * lane.rtf * _cost_units(_RERANK_ROUND, predict_spans)
+            if time.monotonic() + next_round_s > deadline_at:
+                settings["early_stopped"] = True
+                deadline_stop = True
+                break
+
+    if not deadline_stop:
+        # Deadline stops say nothing about how early the margin is reached
+        _RERANK_GENERATED_SHARE = 0.8 * _RERANK_GENERATED_SHARE + 0.2 * generated / planned
+
+    settings.update(
+        reranking_candidates=generated,
+        rounds=len(scores),
+        best_score=round(max(scores), 4),
+    )
+    return best_result, settings
+
+
+def _full_quality(settings: Dict[str, Any], predict_spans: bool, reranking_candidates: int) -> bool:
+    """Whether a separation ran with everything the caller asked for (no deadline shedding)."""
+    return (settings["predict_spans"], settings["reranking_candidates"]) == (predict_spans, reranking_candidates)
+
+
+def _deadline_summary(deadline_ms: float, deadline_at: Optional[float], started: float) -> Dict[str, Any]:
+    now = time.monotonic()
+    return {
+        "deadline_ms": deadline_ms or None,
+        "elapsed_ms": round((now - started) * 1000),
+        "deadline_met": None if deadline_at is None else now <= deadline_at,
+    }
+
+
+def _disentangle_audio(
+    lane: _Lane,
+    wav_path: str,
+    descriptions: List[str],
+    predict_spans: bool = True,
+    reranking_candidates: int = 8,
+    deadline_at: Optional[float] = None,
+    priority: str = PRIORITY_BATCH,
+    job: Optional[_Job] = None,
+    cascade: Optional["_CascadeCheckpoint"] = None,
+    store_fresh: bool = True,
+) -> tuple[List[Dict[str, Any]], torch.Tensor, int, int]:
+    """
+    Iteratively separate each described sound from the audio.
+    Returns list of separated tracks, final residual, sample rate, and the
+    number of iterations resumed from `cascade` instead of recomputed.
+
+    With a cascade checkpoint, a stored run whose descriptions are a prefix of
+    `descriptions` is continued from its last residual, and every new
+    iteration is persisted so a crash or a later "add another stem" request
+    only pays for the new descriptions. Persisting stops at the first track a
+    deadline degraded, since it and every later residual fall short of the
+    settings the checkpoint is keyed by. Without `store_fresh`, a cascade that
+    starts from scratch is not persisted: the caller's audio is only a
+    near-duplicate of the cascade's input and sits on a different timeline.
+
+    The caller holds a slot on `lane`; it is yielded between iterations so
+    queued interactive requests are not stuck behind the whole cascade.
+
+    With a deadline, the remaining time is split evenly across the remaining
+    iterations and each one adapts its reranking depth to its share.
+
+    Each track dict contains:
+    - description: str
+    - audio: torch.Tensor
+    - iteration: int (0-indexed)
+    - settings: Dict (predict_spans / reranking_candidates actually used)
+    - encoded: Future of the base64 WAV (new iterations only)
+    """
+    sr = lane.sample_rate
+
+    state = cascade.load() if cascade is not None else None
+    if state is not None and descriptions[:len(state["descriptions"])] == state["descriptions"]:
+        separated_tracks = cascade.load_tracks(state)
+        current_audio = cascade.load_residual(state).to(_DEVICE)
+        start = len(separated_tracks)
+    else:
+        # Load audio for iteration
+        waveform, file_sr = torchaudio.load(wav_path)
+        if file_sr != sr:
+            waveform = torchaudio.functional.resample(waveform, file_sr, sr)
+
+        # Convert to mono for processing
+        current_audio = waveform.mean(0, keepdim=True).to(_DEVICE)
+        separated_tracks = []
+        start = 0
+        if not store_fresh:
+            cascade = None
+    duration_s = current_audio.size(-1) / float(sr)
+    full_quality = True
+
+    for i in range(start, len(descriptions)):
+        desc = descriptions[i]
+        if i > start:
+            lane.yield_slot(priority)
+        if job is not None and job.cancelled:
+            _CANCEL_COUNTS["iterations_skipped"] += len(descriptions) - i
+            _checkpoint(job, "disentangle iteration")
+
+        # Create a temp file for current residual to feed to processor
+        with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as tf:
+            temp_path = tf.name
+
+        try:
+            # Save current audio state to temp file
+            torchaudio.save(temp_path, current_audio.cpu(), sr)
+
+            iteration_deadline = None
+            if deadline_at is not None:
+                remaining = deadline_at - time.monotonic()
+                iteration_deadline = time.monotonic() + remaining / (len(descriptions) - i)
+
+            result, settings = _separate_adaptive(
+                lane,
+                temp_path,
+                desc,
+                duration_s,
+                predict_spans=predict_spans,
+                reranking_candidates=reranking_candidates,
+                deadline_at=iteration_deadline,
+                priority=priority,
+                job=job,
+            )
+
+            # Extract separated target
+            target = result.target[0]
+            residual = result.residual[0]
+
+            audio = target.cpu()
+            separated_tracks.append({
+                "description": desc,
+                "audio": audio,
+                "iteration": i,
+                "settings": settings,
+                # Encoded on the pool while the next iteration runs
+                "encoded": _encode_wavs_b64([audio], sr)[0],
+            })
+
+            # Update current audio to residual for next iteration
+            current_audio = residual.unsqueeze(0) if residual.dim() == 1 else residual
+            current_audio = current_audio.to(_DEVICE)
+
+            full_quality = full_quality and _full_quality(settings, predict_spans, reranking_candidates)
+            if cascade is not None and full_quality:
+                cascade.save_iteration(separated_tracks, current_audio, sr)
+
+        finally:
+            try:
+                os.unlink(temp_path)
+            except OSError:
+                pass
+
+    # Final residual (whatever's left after all separations)
+    final_residual = current_audio.squeeze(0).cpu()
+
+    return separated_tracks, final_residual, sr, start
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Cascade Checkpoints (resumable / incremental disentangle)
+# ─────────────────────────────────────────────────────────────────────────────
+
+
+def _checkpoint_root() -> Optional[str]:
+    """Cascade checkpoint directory; SAM_CHECKPOINT_DIR="" disables checkpoints."""
+    root = os.getenv("SAM_CHECKPOINT_DIR", "/tmp/sam-audio-checkpoints").strip()
+    return root or None
+
+
+class _CascadeCheckpoint:
+    """
+    On-disk disentangle state for one input and one set of separation
+    parameters: every separated track plus the residual after the last
+    iteration, described by state.json.
+
+    Each run writes its files under names unique to the run and lists them in
+    state.json, which is replaced atomically once they are complete. A crash
+    mid-save, or another run on the same input, therefore never changes what
+    an existing state.json points at. Runs on one input are serialized by
+    _cascade_lock(), which also makes it safe to delete the files the newest
+    state.json no longer references.
+    """
+
+    def __init__(self, root: str, input_key: str, params: Dict[str, Any]):
+        digest = hashlib.sha256(_json.dumps(params, sort_keys=True).encode("utf-8")).hexdigest()
+        self.input_dir = os.path.join(root, input_key)
+        self.path = os.path.join(self.input_dir, digest[:16])
+        self.params = params
+        self.run_id = uuid.uuid4().hex[:8]
+        # Track files of this run's cascade, resumed ones included
+        self.track_files: List[str] = []
+
+    @staticmethod
+    def _track_files(state: Dict[str, Any]) -> List[str]:
+        # state.json from before per-run names listed no files
+        return state.get("tracks") or [f"track_{i}.pt" for i in range(len(state["descriptions"]))]
+
+    def load(self) -> Optional[Dict[str, Any]]:
+        try:
+            with open(os.path.join(self.path, "state.json"), "r", encoding="utf-8") as f:
+                state = _json.load(f)
+        except (OSError, ValueError):
+            return None
+        names = [state.get("residual", "")] + self._track_files(state)
+        if not all(os.path.exists(os.path.join(self.path, name)) for name in names):
+            return None
+        _touch_input(self.input_dir)
+        return state
+
+    def load_tracks(self, state: Dict[str, Any]) -> List[Dict[str, Any]]:
+        self.track_files = self._track_files(state)
+        return [
+            {
+                "description": desc,
+                "audio": torch.load(os.path.join(self.path, name), map_location="cpu"),
+                "iteration": i,
+                "settings": {**state["settings"][i], "resumed": True},
+            }
+            for i, (desc, name) in enumerate(zip(state["descriptions"], self.track_files))
+        ]
+
+    def load_residual(self, state: Dict[str, Any]) -> torch.Tensor:
+        return torch.load(os.path.join(self.path, state["residual"]), map_location="cpu")
+
+    def save_iteration(self, tracks: List[Dict[str, Any]], residual: torch.Tensor, sr: int) -> None:
+        """Persist the newest track and residual, then publish them via state.json."""
+        try:
+            os.makedirs(self.path, exist_ok=True)
+            i = len(tracks) - 1
+            track_name = f"track_{i}-{self.run_id}.pt"
+            torch.save(tracks[i]["audio"], os.path.join(self.path, track_name))
+            residual_name = f"residual_{i + 1}-{self.run_id}.pt"
+            torch.save(residual.cpu(), os.path.join(self.path, residual_name))
+            self.track_files = self.track_files[:i] + [track_name]
+
+            state = {
+                "params": self.params,
+                "sample_rate": sr,
+                "descriptions": [t["description"] for t in tracks],
+                "settings": [{k: v for k, v in t["settings"].items() if k != "resumed"} for t in tracks],
+                "tracks": self.track_files,
+                "residual": residual_name,
+                "updated_at": time.time(),
+            }
+            tmp_path = os.path.join(self.path, f"state.json.{self.run_id}.tmp")
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                _json.dump(state, f)
+            os.replace(tmp_path, os.path.join(self.path, "state.json"))
+
+            # Superseded residuals, and tracks of runs this one replaced
+            keep = set(self.track_files) | {residual_name}
+            for name in os.listdir(self.path):
+                if name.endswith(".pt") and name not in keep:
+                    os.unlink(os.path.join(self.path, name))
+        except OSError as e:
+            # Checkpoints are an optimization; a full disk must not fail the request
+            _record_lifecycle("checkpoint_error", path=self.path, error=str(e))
+            return
+        _touch_input(self.input_dir)
+        _prune_checkpoints()
+
+
+_CASCADE_LOCKS: Dict[str, List[Any]] = {}  # input_key -> [lock, holders + waiters]
+_CASCADE_LOCKS_GUARD = threading.Lock()
+
+
+@contextlib.contextmanager
+def _cascade_lock(input_key: str, job: Optional[_Job] = None):
+    """
+    Run one disentangle cascade per input at a time. Taken before a lane slot
+    so a waiting cascade never holds the slot the running one yields between
+    iterations; the waiter then starts from whatever the other one stored.
+    """
+    with _CASCADE_LOCKS_GUARD:
+        entry = _CASCADE_LOCKS.setdefault(input_key, [threading.Lock(), 0])
+        entry[1] += 1
+    try:
+        while not entry[0].acquire(timeout=0.5):
+            _checkpoint(job, "cascade lock")
+        try:
+            yield
+        finally:
+            entry[0].release()
+    finally:
+        with _CASCADE_LOCKS_GUARD:
+            entry[1] -= 1
+            if entry[1] == 0:
+                _CASCADE_LOCKS.pop(input_key, None)
+
+
+def _touch_input(input_dir: str) -> None:
+    """Mark an input as used. Writes into its subdirectories leave its mtime alone."""
+    with contextlib.suppress(OSError):
+        os.utime(input_dir)
+
+
+def _prune_checkpoints() -> None:
+    """Keep the SAM_CHECKPOINT_MAX_INPUTS most recently used inputs."""
+    root = _checkpoint_root()
+    limit = int(os.getenv("SAM_CHECKPOINT_MAX_INPUTS", "64"))
+    if root is None or limit <= 0:
+        return
+    try:
+        names = os.listdir(root)
+    except OSError:
+        return
+    entries = []
+    for name in names:
+        path = os.path.join(root, name)
+        # Another request may prune the same entry between listdir and stat
+        with contextlib.suppress(OSError):
+            entries.append((os.path.getmtime(path), path))
+    entries.sort(reverse=True)
+    for _, path in entries[limit:]:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def _result_path(input_key: str, kind: str, params: Dict[str, Any]) -> Optional[str]:
+    """Where a finished `kind` result ("separate", "introspect") for `input_key` is stored."""
+    root = _checkpoint_root()
+    if root is None:
+        return None
+    digest = hashlib.sha256(_json.dumps(params, sort_keys=True).encode("utf-8")).hexdigest()
+    return os.path.join(root, input_key, f"{kind}-{digest[:16]}.pt")
+
+
+def _load_result(path: Optional[str]) -> Optional[Dict[str, Any]]:
+    if path is None or not os.path.exists(path):
+        return None
+    try:
+        result = torch.load(path, map_location="cpu")
+    except Exception:
+        return None
+    _touch_input(os.path.dirname(path))
+    return result
+
+
+def _store_result(path: Optional[str], payload: Dict[str, Any]) -> None:
+    if path is None:
+        return
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + ".tmp"
+        torch.save(payload, tmp_path)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        _record_lifecycle("checkpoint_error", path=path, error=str(e))
+        return
+    _touch_input(os.path.dirname(path))
+    _prune_checkpoints()
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Near-Duplicate Detection (acoustic fingerprints)
+# ─────────────────────────────────────────────────────────────────────────────
+
+# Haitsma-Kalker style fingerprint: 32 bits per ~23 ms frame from the sign of
+# energy differences across 33 log-spaced bands and adjacent frames. It
+# survives re-encoding (MP3 <-> AAC/MP4, other bitrates) but not edits.
+_FP_N_FFT = 4096
+_FP_HOP = 1024
+_FP_BANDS = 33
+# Evenly spaced blocks (~3 s each) fingerprinted across the whole track; a
+# match needs every block loud in both uploads to agree, and at least half
+# of the blocks to be loud
+_FP_BLOCKS = 8
+_FP_BLOCK_FRAMES = 128
+_FP_MIN_BLOCKS = _FP_BLOCKS // 2
+_FP_DURATION_TOLERANCE_S = 0.5
+# Offsets (in frames) searched per block: encoder delay and padding, plus the
+# block positions moving with a duration difference up to the tolerance
+_FP_MAX_SHIFT = 24
+_FP_BLOCK_WIDTH = _FP_BLOCK_FRAMES + 2 * _FP_MAX_SHIFT
+_FP_MAX_BER = float(os.getenv("SAM_FINGERPRINT_MAX_BER", "0.2"))
+_POPCOUNT8 = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint16)
+
+
+def _fingerprint(wave: torch.Tensor, sr: int) -> tuple[np.ndarray, float]:
+    """
+    Fingerprint a mono waveform in one vectorized pass.
+    Returns (frames,) uint32 sub-fingerprints and the fraction of frames
+    loud enough to carry information.
+    """
+    if wave.numel() < _FP_N_FFT:
+        return np.zeros(0, dtype=np.uint32), 0.0
+
+    spec = torch.stft(
+        wave.float(),
+        n_fft=_FP_N_FFT,
+        hop_length=_FP_HOP,
+        window=torch.hann_window(_FP_N_FFT),
+        return_complex=True,
+    ).abs().pow(2)
+
+    edges = torch.logspace(math.log10(300.0), math.log10(2000.0), _FP_BANDS + 1)
+    freqs = torch.fft.rfftfreq(_FP_N_FFT, 1.0 / sr)
+    bands = ((freqs >= edges[:-1, None]) & (freqs < edges[1:, None])).float()
+    energy = bands @ spec  # (bands, frames)
+
+    band_diff = energy[:-1] - energy[1:]
+    bits = (band_diff[:, 1:] - band_diff[:, :-1]) > 0  # (32, frames - 1)
+    weights = 2 ** torch.arange(_FP_BANDS - 1, dtype=torch.int64)
+    fp = (bits.T.to(torch.int64) * weights).sum(1).numpy().astype(np.uint32)
+
+    frame_energy = energy.sum(0)[1:]
+    loud = float((frame_energy > frame_energy.max() * 1e-4).float().mean()) if fp.size else 0.0
+    return fp, loud
+
+
+def _fp_block_offsets(duration_s: float) -> np.ndarray:
+    """First sample (at _INPUT_SAMPLE_RATE) of each fingerprint block."""
+    num_frames = (_FP_BLOCK_WIDTH + 1) * _FP_HOP
+    total = int(duration_s * _INPUT_SAMPLE_RATE)
+    centers = total * (np.arange(_FP_BLOCKS) + 0.5) / _FP_BLOCKS
+    return np.minimum(np.maximum(centers - num_frames / 2, 0), total - num_frames).astype(np.int64)
+
+
+def _fingerprint_track(wav_path: str, duration_s: float) -> Optional[tuple[np.ndarray, np.ndarray]]:
+    """
+    Fingerprint `_FP_BLOCKS` evenly spaced blocks spanning the whole input, so
+    uploads that only share an intro or a section are told apart. Only the
+    blocks are read, like introspection excerpts.
+
+    Returns (blocks, width) uint32 fingerprints and which blocks are loud
+    enough to compare, or None for inputs shorter than one block.
+    """
+    num_frames = (_FP_BLOCK_WIDTH + 1) * _FP_HOP
+    if int(duration_s * _INPUT_SAMPLE_RATE) < num_frames:
+        return None
+
+    fps = np.zeros((_FP_BLOCKS, _FP_BLOCK_WIDTH), dtype=np.uint32)
+    loud = np.zeros(_FP_BLOCKS, dtype=bool)
+    for i, offset in enumerate(_fp_block_offsets(duration_s)):
+        wave = _load_mono(wav_path, _INPUT_SAMPLE_RATE, num_frames=num_frames, frame_offset=int(offset))
+        fp, share = _fingerprint(wave, _INPUT_SAMPLE_RATE)
+        n = min(fp.size, _FP_BLOCK_WIDTH)
+        fps[i, :n] = fp[:n]
+        loud[i] = share >= 0.5 and n == _FP_BLOCK_WIDTH
+    return fps, loud
+
+
+class _FingerprintIndex:
+    """
+    Fixed-capacity ring buffer of block fingerprints in one
+    (capacity, blocks, width) uint32 array (~6 KB per entry). Lookups filter
+    by duration, then compare the bit error rate of every block against all
+    candidates at each offset in numpy.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = max(1, capacity)
+        self.frames = np.zeros((self.capacity, _FP_BLOCKS, _FP_BLOCK_WIDTH), dtype=np.uint32)
+        self.loud = np.zeros((self.capacity, _FP_BLOCKS), dtype=bool)
+        self.durations = np.full(self.capacity, -1.0, dtype=np.float32)
+        self.keys: List[Optional[str]] = [None] * self.capacity
+        self.rows: Dict[str, int] = {}
+        self.next_row = 0
+        self.lock = threading.Lock()
+        self.matches = 0
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.rows
+
+    def add(self, key: str, fps: np.ndarray, loud: np.ndarray, duration_s: float) -> None:
+        with self.lock:
+            if key in self.rows:
+                return
+            row = self.next_row
+            self.next_row = (row + 1) % self.capacity
+            if self.keys[row] is not None:
+                self.rows.pop(self.keys[row], None)
+            self.frames[row] = fps
+            self.loud[row] = loud
+            self.durations[row] = duration_s
+            self.keys[row] = key
+            self.rows[key] = row
+
+    def match(self, fps: np.ndarray, loud: np.ndarray, duration_s: float) -> Optional[tuple[str, float, float]]:
+        """
+        Closest entry as (key, worst block bit error rate, offset), or None
+        unless every block compared is at or below _FP_MAX_BER. The offset is
+        how many seconds later the entry's audio starts in the query (negative
+        when the query is missing some of its start), from the median of the
+        best-matching block positions.
+        """
+        with self.lock:
+            candidates = np.nonzero(
+                (self.durations >= 0)
+                & (np.abs(self.durations - duration_s) <= _FP_DURATION_TOLERANCE_S)
+            )[0]
+            if candidates.size == 0:
+                return None
+            # The middle of each entry block is compared against the query block at every offset
+            core = self.frames[candidates, :, _FP_MAX_SHIFT:_FP_MAX_SHIFT + _FP_BLOCK_FRAMES]
+            compared = self.loud[candidates] & loud[None, :]
+            keys = [self.keys[row] for row in candidates]
+            durations = self.durations[candidates]
+
+        block_ber = np.ones((candidates.size, _FP_BLOCKS))
+        block_shift = np.zeros((candidates.size, _FP_BLOCKS), dtype=np.int64)
+        for shift in range(2 * _FP_MAX_SHIFT + 1):
+            diff = core ^ fps[None, :, shift:shift + _FP_BLOCK_FRAMES]
+            errors = _POPCOUNT8[diff.view(np.uint8)].reshape(candidates.size, _FP_BLOCKS, -1).sum(-1)
+            ber = errors / (_FP_BLOCK_FRAMES * 32)
+            block_shift = np.where(ber < block_ber, shift, block_shift)
+            block_ber = np.minimum(block_ber, ber)
+
+        worst = np.where(compared, block_ber, 0.0).max(1)
+        worst = np.where(compared.sum(1) >= _FP_MIN_BLOCKS, worst, 1.0)
+        best = int(worst.argmin())
+        if worst[best] > _FP_MAX_BER:
+            return None
+
+        # Entry block i at entry sample e + _FP_MAX_SHIFT hops lines up with query sample q + shift hops
+        lags = (
+            _fp_block_offsets(duration_s)
+            - _fp_block_offsets(float(durations[best]))
+            + (block_shift[best] - _FP_MAX_SHIFT) * _FP_HOP
+        )
+        offset_s = float(np.median(lags[compared[best]])) / _INPUT_SAMPLE_RATE
+        return keys[best], float(worst[best]), offset_s
+
+
+_FP_INDEX = _FingerprintIndex(int(os.getenv("SAM_FINGERPRINT_MAX_ENTRIES", "4096")))
+_ATLAS_DIGEST = hashlib.sha256("\n".join(SOUND_ATLAS).encode("utf-8")).hexdigest()[:16]
+
+
+def _resolve_input(raw: bytes, wav_path: str, reuse: bool = True) -> tuple[str, Dict[str, Any]]:
+    """
+    Map an upload to the key its stored results live under: its own SHA-256,
+    or, when `reuse` is set, the key of an earlier near-duplicate upload (the
+    same song re-encoded or in another container).
+    """
+    input_key = hashlib.sha256(raw).hexdigest()
+    if input_key in _FP_INDEX:
+        return input_key, {"input_key": input_key, "match": "exact"}
+
+    started = time.perf_counter()
+    duration_s = _wav_duration(wav_path)
+    with torch.profiler.record_function("sam_audio::fingerprint"):
+        blocks = _fingerprint_track(wav_path, duration_s)
+    info: Dict[str, Any] = {"input_key": input_key, "match": None}
+
+    # Near-silent and very short inputs are not indexed
+    if blocks is not None and blocks[1].sum() >= _FP_MIN_BLOCKS:
+        fps, loud = blocks
+        found = _FP_INDEX.match(fps, loud, duration_s) if reuse else None
+        if found is not None:
+            _FP_INDEX.matches += 1
+            info = {
+                "input_key": found[0],
+                "match": "fingerprint",
+                "bit_error_rate": round(found[1], 4),
+                "offset_ms": round(found[2] * 1000, 1),
+            }
+        else:
+            _FP_INDEX.add(input_key, fps, loud, duration_s)
+
+    info["fingerprint_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    return info["input_key"], info
+
+
+def _align_to_upload(audio: torch.Tensor, sr: int, reuse_info: Dict[str, Any], duration_s: float) -> torch.Tensor:
+    """
+    Fit a stem stored for an earlier near-duplicate to this upload: shift it by
+    the fingerprint offset, then trim or zero-pad it to this upload's length.
+    """
+    shift = int(round(reuse_info.get("offset_ms", 0.0) / 1000 * sr))
+    if shift > 0:
+        audio = torch.nn.functional.pad(audio, (shift, 0))
+    elif shift < 0:
+        audio = audio[..., -shift:]
+    length = int(round(duration_s * sr))
+    if audio.size(-1) >= length:
+        return audio[..., :length]
+    return torch.nn.functional.pad(audio, (0, length - audio.size(-1)))
+
+
+def _introspect_cached(
+    input_key: str,
+    wav_path: str,
+    threshold: float,
+    top_k_fallback: int,
+    priority: str,
+    reuse: bool = True,
+    job: Optional[_Job] = None,
+) -> tuple[List[str], Dict[str, float], bool]:
+    """Sound Atlas introspection, reusing stored scores for `input_key` when present."""
+    path = _result_path(input_key, "introspect", {
+        "atlas": _ATLAS_DIGEST,
+        "excerpts": [_INTROSPECT_EXCERPTS, _INTROSPECT_EXCERPT_SECONDS, _INTROSPECT_STRATEGY],
+        "pooling": _INTROSPECT_POOLING,
+    })
+    stored = _load_result(path) if reuse else None
+    if stored is not None:
+        scores = stored["scores"]
+        return _select_descriptions(SOUND_ATLAS, scores, threshold, top_k_fallback), scores, True
+
+    _ensure_clap_loaded()
+    excerpts = _load_excerpts(wav_path, _wav_duration(wav_path))
+    selected, scores = _introspect_audio(
+        audio_tensor=excerpts if excerpts is not None else _load_mono(wav_path, _INPUT_SAMPLE_RATE),
+        sample_rate=_INPUT_SAMPLE_RATE,
+        descriptions=SOUND_ATLAS,
+        threshold=threshold,
+        top_k_fallback=top_k_fallback,
+        priority=priority,
+        job=job,
+        pooling=_INTROSPECT_POOLING,
+    )
+    _store_result(path, {"scores": scores})
+    return selected, scores, False
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Request Handlers (shared by the webapp and Vertex AI routes)
+# ─────────────────────────────────────────────────────────────────────────────
+
+
+def _run_separate(
+    raw: bytes,
+    filename: str,
+    description: str,
+    anchors_json: str,
+    predict_spans: bool,
+    reranking_candidates: int,
+    tier: str = "",
+    latency_budget_ms: float = 0.0,
+    deadline_ms: float = 0.0,
+    started: Optional[float] = None,
+    reuse: bool = True,
+    job: Optional[_Job] = None,
+) -> Dict[str, Any]:
+    started = time.monotonic() if started is None else started
+    deadline_at = _deadline_at(deadline_ms, started)
+    with tempfile.TemporaryDirectory() as td:
+        wav_path = _decode_upload(raw, filename, td)
+        duration_s = _wav_duration(wav_path)
+        input_key, reuse_info = _resolve_input(raw, wav_path, reuse)
+        _checkpoint(job, "routing")
+
+        # anchors_json is a string representation like:
+        # [["+", 6.3, 7.0], ["-", 0.0, 1.0]]
+        anchors = None
+        if anchors_json and anchors_json.strip():
+            anchors = [_json.loads(anchors_json)]
+
+        candidates, reranking_candidates, routing = _route(
+            tier, latency_budget_ms, duration_s, reranking_candidates
+        )
+        routing["reranking_candidates"] = reranking_candidates
+
+        def _params(lane: _Lane) -> Dict[str, Any]:
+            return {
+                "model_id": lane.model_id,
+                "description": description or "",
+                "anchors": anchors,
+                "predict_spans": predict_spans,
+                "reranking_candidates": reranking_candidates,
+            }
+
+        stored = _load_result(_result_path(input_key, "separate", _params(candidates[0]))) if reuse else None
+        if stored is not None:
+            routing.update(variant=candidates[0].model_id, fallback=False)
+            sr = stored["sample_rate"]
+            stems = [stored["target"], stored["residual"]]
+            if reuse_info["match"] == "fingerprint":
+                stems = [_align_to_upload(stem, sr, reuse_info, duration_s) for stem in stems]
+            target_b64, residual_b64 = (f.result() for f in _encode_wavs_b64(stems, sr))
+            return {
+                "ok": True,
+                "target_wav_base64": target_b64,
+                "residual_wav_base64": residual_b64,
+                "routing": routing,
+                "settings": {
+                    **stored["settings"],
+                    "reused": True,
+                    **_deadline_summary(deadline_ms, deadline_at, started),
+                },
+                "reuse": reuse_info,
+            }
+
+        # A stored result needs no device memory, so it is checked before admission
+        candidates, routing["memory"] = _memory_routing(candidates, duration_s, reranking_candidates)
+        lane = _acquire_lane(candidates, routing, PRIORITY_INTERACTIVE, job)
+        try:
+            _checkpoint(job, "separation")
+            result, settings = _separate_adaptive(
+                lane,
+                wav_path,
+                description or "",
+                duration_s,
+                anchors=anchors,
+                predict_spans=predict_spans,
+                reranking_candidates=reranking_candidates,
+                deadline_at=deadline_at,
+                job=job,
+            )
+            sr = lane.sample_rate
+        finally:
+            lane.release()
+
+        _checkpoint(job, "encoding")
+
+        target = result.target[0]
+        residual = result.residual[0]
+
+        # Only full-quality results are worth serving to later requests. Stems of a
+        # near-duplicate are on its own timeline, not that of the input it matched.
+        if reuse_info["match"] != "fingerprint" and _full_quality(settings, predict_spans, reranking_candidates):
+            _store_result(_result_path(input_key, "separate", _params(lane)), {
+                "target": target.cpu(),
+                "residual": residual.cpu(),
+                "sample_rate": sr,
+                "settings": settings,
+            })
+
+        target_b64, residual_b64 = (f.result() for f in _encode_wavs_b64([target, residual], sr))
+        return {
+            "ok": True,
+            "target_wav_base64": target_b64,
+            "residual_wav_base64": residual_b64,
+            "routing": routing,
+            "settings": {**settings, **_deadline_summary(deadline_ms, deadline_at, started)},
+            "reuse": reuse_info,
+        }
+
+
+def _run_disentangle(
+    raw: bytes,
+    filename: str,
+    descriptions: List[str],
+    threshold: float,
+    top_k_fallback: int,
+    predict_spans: bool,
+    reranking_candidates: int,
+    tier: str = "",
+    latency_budget_ms: float = 0.0,
+    deadline_ms: float = 0.0,
+    started: Optional[float] = None,
+    resume: bool = True,
+    extend: bool = False,
+    reuse: bool = True,
+    job: Optional[_Job] = None,
+) -> Dict[str, Any]:
+    started = time.monotonic() if started is None else started
+    deadline_at = _deadline_at(deadline_ms, started)
+    with tempfile.TemporaryDirectory() as td:
+        wav_path = _decode_upload(raw, filename, td)
+        duration_s = _wav_duration(wav_path)
+        input_key, reuse_info = _resolve_input(raw, wav_path, reuse)
+        _checkpoint(job, "introspection")
+
+        desc_list = list(descriptions)
+        introspection_scores: Dict[str, float] = {}
+
+        # Auto-detect instruments if no descriptions provided
+        if not desc_list:
+            desc_list, introspection_scores, _ = _introspect_cached(
+                input_key,
+                wav_path,
+                threshold,
+                top_k_fallback,
+                PRIORITY_BATCH,
+                reuse,
+                job,
+            )
+
+        if not desc_list:
+            return {
+                "ok": False,
+                "error": "No instruments detected and no descriptions provided",
+                "introspection_scores": introspection_scores,
+            }
+
+        # The whole cascade runs on one lane, so budget for every iteration
+        candidates, reranking_candidates, routing = _route(
+            tier, latency_budget_ms, duration_s * len(desc_list), reranking_candidates
+        )
+        routing["reranking_candidates"] = reranking_candidates
+
+        root = _checkpoint_root() if resume or extend else None
+
+        def _cascade_for(lane: _Lane) -> Optional[_CascadeCheckpoint]:
+            if root is None:
+                return None
+            return _CascadeCheckpoint(root, input_key, {
+                "model_id": lane.model_id,
+                "predict_spans": predict_spans,
+                "reranking_candidates": reranking_candidates,
+            })
+
+        # Holding the lock from the state check to the last save keeps concurrent
+        # cascades on this input from interleaving their checkpoint writes
+        lock = _cascade_lock(input_key, job) if root is not None else contextlib.nullcontext()
+        with lock:
+            cascade = _cascade_for(candidates[0])
+            state = cascade.load() if cascade is not None else None
+            if extend and state is not None:
+                done = state["descriptions"]
+                desc_list = done + [d for d in desc_list if d not in done]
+
+            if state is not None and state["descriptions"] == desc_list:
+                # Everything was separated before: answer from disk without a lane slot
+                separated_tracks = cascade.load_tracks(state)
+                final_residual = cascade.load_residual(state).squeeze(0)
+                sr = int(state["sample_rate"])
+                resumed = len(separated_tracks)
+                routing.update(variant=candidates[0].model_id, fallback=False)
+            else:
+                # Every iteration separates a residual as long as the input
+                candidates, routing["memory"] = _memory_routing(candidates, duration_s, reranking_candidates)
+                # Perform iterative separation
+                lane = _acquire_lane(candidates, routing, PRIORITY_BATCH, job)
+                try:
+                    separated_tracks, final_residual, sr, resumed = _disentangle_audio(
+                        lane,
+                        wav_path=wav_path,
+                        descriptions=desc_list,
+                        predict_spans=predict_spans,
+                        reranking_candidates=reranking_candidates,
+                        deadline_at=deadline_at,
+                        priority=PRIORITY_BATCH,
+                        job=job,
+                        cascade=_cascade_for(lane),
+                        store_fresh=reuse_info["match"] != "fingerprint",
+                    )
+                finally:
+                    lane.release()
+
+        # Stems resumed from a near-duplicate's cascade, and everything separated
+        # from its residual, are on that input's timeline
+        if resumed and reuse_info["match"] == "fingerprint":
+            for track in separated_tracks:
+                track["audio"] = _align_to_upload(track["audio"], sr, reuse_info, duration_s)
+                track.pop("encoded", None)
+            final_residual = _align_to_upload(final_residual, sr, reuse_info, duration_s)
+
+        _checkpoint(job, "encoding")
+
+        # Tracks from this run are already encoding; batch the stored ones with the residual
+        pending = [track for track in separated_tracks if "encoded" not in track]
+        futures = _encode_wavs_b64([track["audio"] for track in pending] + [final_residual], sr)
+        for track, future in zip(pending, futures):
+            track["encoded"] = future
+
+        tracks_output = [
+            {
+                "description": track["description"],
+                "wav_base64": track["encoded"].result(),
+                "iteration": track["iteration"],
+                "settings": track["settings"],
+            }
+            for track in separated_tracks
+        ]
+
+        return {
+            "ok": True,
+            "detected_instruments": desc_list,
+            "introspection_scores": introspection_scores,
+            "tracks": tracks_output,
+            "residual_wav_base64": futures[-1].result(),
+            "routing": routing,
+            "settings": _deadline_summary(deadline_ms, deadline_at, started),
+            "checkpoint": {"input_key": input_key, "resumed_iterations": resumed},
+            "reuse": reuse_info,
+        }
+
+
+def _run_introspect(
+    raw: bytes,
+    filename: str,
+    threshold: float,
+    top_k: int,
+    reuse: bool = True,
+    job: Optional[_Job] = None,
+) -> Dict[str, Any]:
+    with tempfile.TemporaryDirectory() as td:
+        wav_path = _decode_upload(raw, filename, td)
+        input_key, reuse_info = _resolve_input(raw, wav_path, reuse)
+        _checkpoint(job, "introspection")
+
+        # Run introspection
+        selected, all_scores, reused = _introspect_cached(
+            input_key,
+            wav_path,
+            threshold,
+            top_k,
+            PRIORITY_INTERACTIVE,
+            reuse,
+            job,
+        )
+        reuse_info["reused"] = reused
+
+        # Sort scores descending for readability
+        sorted_scores = dict(
+            sorted(all_scores.items(), key=lambda x: x[1], reverse=True)
+        )
+
+        return {
+            "ok": True,
+            "detected_instruments": selected,
+            "scores": sorted_scores,
+            "reuse": reuse_info,
+        }
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Shared Task Queue (pull mode across replicas)
+# ─────────────────────────────────────────────────────────────────────────────
+
+# Task states: pending -> leased -> done | failed | cancelled. A leased task
+# whose lease is not renewed by heartbeats becomes leasable again (retry).
+_QUEUE_FINISHED = ("done", "failed", "cancelled")
+_QUEUE_VISIBILITY_SECONDS = float(os.getenv("SAM_QUEUE_VISIBILITY_SECONDS", "60"))
+_QUEUE_HEARTBEAT_SECONDS = float(os.getenv("SAM_QUEUE_HEARTBEAT_SECONDS", str(_QUEUE_VISIBILITY_SECONDS / 4)))
+_QUEUE_MAX_ATTEMPTS = max(1, int(os.getenv("SAM_QUEUE_MAX_ATTEMPTS", "3")))
+_QUEUE_POLL_SECONDS = float(os.getenv("SAM_QUEUE_POLL_SECONDS", "1"))
+_QUEUE_RESULT_TTL_SECONDS = float(os.getenv("SAM_QUEUE_RESULT_TTL_SECONDS", "86400"))
+_WORKER_ID = f"{socket.gethostname()}-{uuid.uuid4().hex[:6]}"
+
+
+class _TaskExists(RuntimeError):
+    """Raised when a task is submitted with an id that is already queued."""
+
+
+def _retry_delay(attempts: int) -> float:
+    return min(2.0 ** attempts, 60.0)
+
+
+class _SQLiteQueue:
+    """
+    Task queue in one SQLite file, shared by replicas on the same host or
+    volume. Leases are taken inside BEGIN IMMEDIATE so only one replica wins.
+    Results (base64 stems can exceed SQLite's 1 GB value limit) are JSON files
+    in a results/ directory next to the database; the row holds the file name.
+    """
+
+    name = "sqlite"
+
+    def __init__(self, path: str):
+        self.path = path
+        self.results_dir = os.path.join(os.path.dirname(path) or ".", "results")
+        os.makedirs(self.results_dir, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS tasks (
+                    task_id TEXT PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    params TEXT NOT NULL,
+                    audio BLOB,
+                    status TEXT NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    lease_id TEXT,
+                    leased_by TEXT,
+                    lease_expires REAL,
+                    visible_at REAL NOT NULL,
+                    cancel_requested INTEGER NOT NULL DEFAULT 0,
+                    submitted_at REAL NOT NULL,
+                    updated_at REAL NOT NULL,
+                    result TEXT,
+                    error TEXT
+                )
+                """
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS tasks_ready ON tasks (status, visible_at)")
+
+    @contextlib.contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def _write_result(self, result: Dict[str, Any]) -> str:
+        name = f"{uuid.uuid4().hex}.json"
+        tmp_path = os.path.join(self.results_dir, name + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            _json.dump(result, f)
+        os.replace(tmp_path, os.path.join(self.results_dir, name))
+        return name
+
+    def _read_result(self, value: Optional[str]) -> Optional[Dict[str, Any]]:
+        if not value:
+            return None
+        if value.startswith("{"):
+            # Rows finished before results moved out of the table
+            return _json.loads(value)
+        try:
+            with open(os.path.join(self.results_dir, value), "r", encoding="utf-8") as f:
+                return _json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _drop_result(self, value: Optional[str]) -> None:
+        if value and not value.startswith("{"):
+            try:
+                os.unlink(os.path.join(self.results_dir, value))
+            except FileNotFoundError:
+                pass
+
+    def submit(self, task_id: str, kind: str, params: Dict[str, Any], audio: bytes) -> None:
+        now = time.time()
+        try:
+            with self._connect() as conn:
+                conn.execute(
+                    "INSERT INTO tasks (task_id, kind, params, audio, status, visible_at, submitted_at, updated_at)"
+                    " VALUES (?, ?, ?, ?, 'pending', ?, ?, ?)",
+                    (task_id, kind, _json.dumps(params), audio, now, now, now),
+                )
+        except sqlite3.IntegrityError as e:
+            raise _TaskExists(task_id) from e
+
+    def lease(self, worker_id: str, visibility_s: float) -> Optional[Dict[str, Any]]:
+        with self._connect() as conn:
+            while True:
+                now = time.time()
+                conn.execute("BEGIN IMMEDIATE")
+                row = conn.execute(
+                    "SELECT task_id, attempts FROM tasks"
+                    " WHERE (status = 'pending' AND visible_at <= ?) OR (status = 'leased' AND lease_expires <= ?)"
+                    " ORDER BY submitted_at LIMIT 1",
+                    (now, now),
+                ).fetchone()
+                if row is None:
+                    conn.execute("COMMIT")
+                    return None
+                if row["attempts"] >= _QUEUE_MAX_ATTEMPTS:
+                    # Its last lease expired without a result: the replica died mid-task
+                    conn.execute(
+                        "UPDATE tasks SET status = 'failed', audio = NULL, updated_at = ?, error = ? WHERE task_id = ?",
+                        (now, f"Lease expired after {row['attempts']} attempts", row["task_id"]),
+                    )
+                    conn.execute("COMMIT")
+                    continue
+                lease_id = uuid.uuid4().hex
+                conn.execute(
+                    "UPDATE tasks SET status = 'leased', attempts = attempts + 1, lease_id = ?, leased_by = ?,"
+                    " lease_expires = ?, updated_at = ? WHERE task_id = ?",
+                    (lease_id, worker_id, now + visibility_s, now, row["task_id"]),
+                )
+                task = conn.execute(
+                    "SELECT task_id, kind, params, audio, attempts, submitted_at FROM tasks WHERE task_id = ?",
+                    (row["task_id"],),
+                ).fetchone()
+                conn.execute("COMMIT")
+                return {**dict(task), "params": _json.loads(task["params"]), "lease_id": lease_id}
+
+    def heartbeat(self, task_id: str, lease_id: str, visibility_s: float) -> str:
+        """Extend the lease. Returns "ok", "cancelled" or "lost"."""
+        now = time.time()
+        with self._connect() as conn:
+            updated = conn.execute(
+                "UPDATE tasks SET lease_expires = ?, updated_at = ? WHERE task_id = ? AND lease_id = ? AND status = 'leased'",
+                (now + visibility_s, now, task_id, lease_id),
+            ).rowcount
+            if not updated:
+                return "lost"
+            row = conn.execute("SELECT cancel_requested FROM tasks WHERE task_id = ?", (task_id,)).fetchone()
+        return "cancelled" if row["cancel_requested"] else "ok"
+
+    def finish(self, task_id: str, lease_id: str, status: str, result: Optional[Dict[str, Any]] = None,
+               error: Optional[str] = None, retry: bool = False) -> bool:
+        """Record the outcome of a lease; with `retry`, put the task back if attempts remain."""
+        now = time.time()
+        # Written before the transaction so a large result does not hold the write lock
+        result_name = None if result is None else self._write_result(result)
+        stored = False
+        try:
+            with self._connect() as conn:
+                conn.execute("BEGIN IMMEDIATE")
+                row = conn.execute(
+                    "SELECT attempts, cancel_requested FROM tasks WHERE task_id = ? AND lease_id = ? AND status = 'leased'",
+                    (task_id, lease_id),
+                ).fetchone()
+                if row is None:
+                    conn.execute("COMMIT")
+                    return False
+                if retry and row["attempts"] < _QUEUE_MAX_ATTEMPTS and not row["cancel_requested"]:
+                    conn.execute(
+                        "UPDATE tasks SET status = 'pending', lease_id = NULL, visible_at = ?, updated_at = ?, error = ?"
+                        " WHERE task_id = ?",
+                        (now + _retry_delay(row["attempts"]), now, error, task_id),
+                    )
+                else:
+                    conn.execute(
+                        "UPDATE tasks SET status = ?, audio = NULL, result = ?, error = ?, updated_at = ? WHERE task_id = ?",
+                        (status, result_name, error, now, task_id),
+                    )
+                    stored = True
+                conn.execute("COMMIT")
+        finally:
+            if not stored:
+                self._drop_result(result_name)
+        return True
+
+    def cancel(self, task_id: str) -> Optional[str]:
+        """Cancel a pending task outright, or flag a leased one. Returns its status."""
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE tasks SET status = 'cancelled', audio = NULL, updated_at = ?, error = 'cancel requested'"
+                " WHERE task_id = ? AND status = 'pending'",
+                (now, task_id),
+            )
+            conn.execute("UPDATE tasks SET cancel_requested = 1 WHERE task_id = ? AND status = 'leased'", (task_id,))
+            row = conn.execute("SELECT status FROM tasks WHERE task_id = ?", (task_id,)).fetchone()
+        return None if row is None else row["status"]
+
+    def get(self, task_id: str) -> Optional[Dict[str, Any]]:
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT task_id, kind, status, attempts, leased_by, submitted_at, updated_at, result, error"
+                " FROM tasks WHERE task_id = ?",
+                (task_id,),
+            ).fetchone()
+        if row is None:
+            return None
+        return {**dict(row), "result": self._read_result(row["result"])}
+
+    def prune(self, older_than: float) -> None:
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            rows = conn.execute(
+                "SELECT result FROM tasks WHERE status IN ('done', 'failed', 'cancelled') AND updated_at < ?",
+                (older_than,),
+            ).fetchall()
+            conn.execute(
+                "DELETE FROM tasks WHERE status IN ('done', 'failed', 'cancelled') AND updated_at < ?",
+                (older_than,),
+            )
+            conn.execute("COMMIT")
+        for row in rows:
+            self._drop_result(row["result"])
+
+    def counts(self) -> Dict[str, int]:
+        with self._connect() as conn:
+            rows = conn.execute("SELECT status, COUNT(*) AS n FROM tasks GROUP BY status").fetchall()
+        return {row["status"]: row["n"] for row in rows}
+
+
+class _MongoQueue:
+    """
+    Task queue in MongoDB (MONGO_URL / MONGO_DB_NAME, as used by the webapp).
+    Leases are atomic find_one_and_update calls; audio and results live in
+    GridFS so neither is bound by the 16 MB document limit.
+    """
+
+    name = "mongo"
+
+    def __init__(self, url: str, db_name: str, collection: str):
+        try:
+            import gridfs
+            import pymongo
+        except ImportError as e:
+            raise RuntimeError("SAM_QUEUE_BACKEND=mongo requires the pymongo package") from e
+
+        self._return_after = pymongo.ReturnDocument.AFTER
+        db = pymongo.MongoClient(url)[db_name]
+        self.tasks = db[collection]
+        self.blobs = gridfs.GridFS(db, collection=f"{collection}_blobs")
+        self.tasks.create_index([("status", 1), ("visible_at", 1)])
+        self.tasks.create_index([("status", 1), ("lease_expires", 1)])
+
+    def _drop_blobs(self, doc: Dict[str, Any], *fields: str) -> None:
+        for field in fields:
+            if doc.get(field) is not None:
+                self.blobs.delete(doc[field])
+
+    def submit(self, task_id: str, kind: str, params: Dict[str, Any], audio: bytes) -> None:
+        import pymongo.errors
+
+        now = time.time()
+        audio_id = self.blobs.put(audio)
+        try:
+            self.tasks.insert_one({
+                "_id": task_id,
+                "kind": kind,
+                "params": params,
+                "audio_id": audio_id,
+                "status": "pending",
+                "attempts": 0,
+                "cancel_requested": False,
+                "visible_at": now,
+                "submitted_at": now,
+                "updated_at": now,
+            })
+        except pymongo.errors.DuplicateKeyError as e:
+            self.blobs.delete(audio_id)
+            raise _TaskExists(task_id) from e
+
+    def lease(self, worker_id: str, visibility_s: float) -> Optional[Dict[str, Any]]:
+        while True:
+            now = time.time()
+            lease_id = uuid.uuid4().hex
+            doc = self.tasks.find_one_and_update(
+                {"$or": [
+                    {"status": "pending", "visible_at": {"$lte": now}},
+                    {"status": "leased", "lease_expires": {"$lte": now}},
+                ]},
+                {
+                    "$set": {
+                        "status": "leased",
+                        "lease_id": lease_id,
+                        "leased_by": worker_id,
+                        "lease_expires": now + visibility_s,
+                        "updated_at": now,
+                    },
+                    "$inc": {"attempts": 1},
+                },
+                sort=[("submitted_at", 1)],
+                return_document=self._return_after,
+            )
+            if doc is None:
+                return None
+            if doc["attempts"] > _QUEUE_MAX_ATTEMPTS:
+                # Its last lease expired without a result: the replica died mid-task
+                self.tasks.update_one({"_id": doc["_id"], "lease_id": lease_id}, {"$set": {
+                    "status": "failed",
+                    "attempts": doc["attempts"] - 1,
+                    "audio_id": None,
+                    "updated_at": now,
+                    "error": f"Lease expired after {doc['attempts'] - 1} attempts",
+                }})
+                self._drop_blobs(doc, "audio_id")
+                continue
+            return {
+                "task_id": doc["_id"],
+                "kind": doc["kind"],
+                "params": doc["params"],
+                "audio": self.blobs.get(doc["audio_id"]).read(),
+                "attempts": doc["attempts"],
+                "submitted_at": doc["submitted_at"],
+                "lease_id": lease_id,
+            }
+
+    def heartbeat(self, task_id: str, lease_id: str, visibility_s: float) -> str:
+        """Extend the lease. Returns "ok", "cancelled" or "lost"."""
+        now = time.time()
+        doc = self.tasks.find_one_and_update(
+            {"_id": task_id, "lease_id": lease_id, "status": "leased"},
+            {"$set": {"lease_expires": now + visibility_s, "updated_at": now}},
+            projection={"cancel_requested": 1},
+        )
+        if doc is None:
+            return "lost"
+        return "cancelled" if doc.get("cancel_requested") else "ok"
+
+    def finish(self, task_id: str, lease_id: str, status: str, result: Optional[Dict[str, Any]] = None,
+               error: Optional[str] = None, retry: bool = False) -> bool:
+        """Record the outcome of a lease; with `retry`, put the task back if attempts remain."""
+        now = time.time()
+        doc = self.tasks.find_one({"_id": task_id, "lease_id": lease_id, "status": "leased"})
+        if doc is None:
+            return False
+        if retry and doc["attempts"] < _QUEUE_MAX_ATTEMPTS and not doc.get("cancel_requested"):
+            update = {"status": "pending", "lease_id": None, "visible_at": now + _retry_delay(doc["attempts"])}
+        else:
+            result_id = None if result is None else self.blobs.put(_json.dumps(result).encode("utf-8"))
+            update = {"status": status, "audio_id": None, "result_id": result_id}
+        update.update(updated_at=now, error=error)
+        updated = self.tasks.update_one({"_id": task_id, "lease_id": lease_id, "status": "leased"}, {"$set": update})
+        if not updated.modified_count:
+            # The lease expired meanwhile and another replica owns the task now
+            self._drop_blobs(update, "result_id")
+            return False
+        if update["status"] != "pending":
+            self._drop_blobs(doc, "audio_id")
+        return True
+
+    def cancel(self, task_id: str) -> Optional[str]:
+        """Cancel a pending task outright, or flag a leased one. Returns its status."""
+        now = time.time()
+        doc = self.tasks.find_one_and_update(
+            {"_id": task_id, "status": "pending"},
+            {"$set": {"status": "cancelled", "audio_id": None, "updated_at": now, "error": "cancel requested"}},
+        )
+        if doc is not None:
+            self._drop_blobs(doc, "audio_id")
+        self.tasks.update_one({"_id": task_id, "status": "leased"}, {"$set": {"cancel_requested": True}})
+        doc = self.tasks.find_one({"_id": task_id}, projection={"status": 1})
+        return None if doc is None else doc["status"]
+
+    def get(self, task_id: str) -> Optional[Dict[str, Any]]:
+        doc = self.tasks.find_one({"_id": task_id}, projection={"params": 0})
+        if doc is None:
+            return None
+        result = None
+        if doc.get("result_id") is not None:
+            result = _json.loads(self.blobs.get(doc["result_id"]).read())
+        return {
+            "task_id": doc["_id"],
+            **{key: doc.get(key) for key in ("kind", "status", "attempts", "leased_by", "submitted_at", "updated_at", "error")},
+            "result": result,
+        }
+
+    def prune(self, older_than: float) -> None:
+        query = {"status": {"$in": list(_QUEUE_FINISHED)}, "updated_at": {"$lt": older_than}}
+        for doc in self.tasks.find(query, projection={"audio_id": 1, "result_id": 1}):
+            self._drop_blobs(doc, "audio_id", "result_id")
+            self.tasks.delete_one({"_id": doc["_id"]})
+
+    def counts(self) -> Dict[str, int]:
+        return {row["_id"]: row["n"] for row in self.tasks.aggregate([{"$group": {"_id": "$status", "n": {"$sum": 1}}}])}
+
+
+_QUEUE: Optional[Union[_SQLiteQueue, _MongoQueue]] = None
+_QUEUE_COUNTS = collections.Counter()
+# Recent backend errors; kept apart from the lifecycle log, which an unreachable
+# backend would otherwise flood once per poll
+_QUEUE_ERRORS: collections.deque = collections.deque(maxlen=8)
+
+
+def _queue_error(error: Exception, task_id: Optional[str] = None) -> None:
+    _QUEUE_COUNTS["backend_errors"] += 1
+    _QUEUE_ERRORS.append({"at": time.time(), "task_id": task_id, "error": str(error)})
+
+
+def _build_queue() -> None:
+    """Connect the backend named by SAM_QUEUE_BACKEND ("" keeps pull mode off)."""
+    global _QUEUE
+    backend = os.getenv("SAM_QUEUE_BACKEND", "").strip().lower()
+    if not backend:
+        _QUEUE = None
+    elif backend == "sqlite":
+        _QUEUE = _SQLiteQueue(os.getenv("SAM_QUEUE_SQLITE_PATH", "/tmp/sam-audio-queue/tasks.sqlite3"))
+    elif backend == "mongo":
+        url = os.getenv("MONGO_URL", "").strip()
+        if not url:
+            raise RuntimeError("SAM_QUEUE_BACKEND=mongo requires MONGO_URL")
+        _QUEUE = _MongoQueue(
+            url,
+            os.getenv("MONGO_DB_NAME", "vocalx").strip(),
+            os.getenv("SAM_QUEUE_COLLECTION", "sam_audio_tasks").strip(),
+        )
+    else:
+        raise RuntimeError(f"Unknown SAM_QUEUE_BACKEND {backend!r}; use sqlite or mongo")
+
+
+def _queue_status() -> Optional[Dict[str, Any]]:
+    if _QUEUE is None:
+        return None
+    try:
+        tasks: Any = _QUEUE.counts()
+    except Exception as e:
+        tasks = {"error": str(e)}
+    return {
+        "backend": _QUEUE.name,
+        "worker_id": _WORKER_ID,
+        "tasks": tasks,
+        "this_worker": dict(_QUEUE_COUNTS),
+        "recent_errors": list(_QUEUE_ERRORS),
+    }
+
+
+def _has_free_slot() -> bool:
+    """Only lease work this replica can start right away; busy replicas leave it to idle ones."""
+    lanes = list(_LANES.values())
+    return sum(lane.active + lane.waiting for lane in lanes) < sum(lane.concurrency for lane in lanes)
+
+
+def _task_call(task: Dict[str, Any]) -> tuple:
+    """(handler, args) for a leased task; deadlines count from submission."""
+    started = time.monotonic() - max(0.0, time.time() - task["submitted_at"])
+    raw = bytes(task["audio"])
+    if task["kind"] == "separate":
+        inst = Instance(audio_b64="", **task["params"])
+        return _run_separate, (
+            raw,
+            inst.filename,
+            inst.description,
+            inst.anchors_json,
+            bool(inst.predict_spans),
+            int(inst.reranking_candidates or 0),
+            inst.tier,
+            inst.latency_budget_ms,
+            inst.deadline_ms,
+            started,
+            inst.reuse,
+        )
+    inst = DisentangleInstance(audio_b64="", **task["params"])
+    return _run_disentangle, (
+        raw,
+        inst.filename,
+        inst.descriptions,
+        inst.threshold,
+        inst.top_k_fallback,
+        inst.predict_spans,
+        inst.reranking_candidates,
+        inst.tier,
+        inst.latency_budget_ms,
+        inst.deadline_ms,
+        started,
+        inst.resume,
+        inst.extend,
+        inst.reuse,
+    )
+
+
+def _finish_task(task_id: str, lease_id: str, status: str, **outcome: Any) -> None:
+    """
+    Record a task's outcome without letting a backend error escape. A result
+    the backend cannot store (too large, or rejected) is recorded as a failure
+    instead; if even that fails, the lease runs out and the task is retried.
+    """
+    assert _QUEUE is not None
+    try:
+        _QUEUE.finish(task_id, lease_id, status, **outcome)
+        return
+    except Exception as e:
+        _queue_error(e, task_id)
+        if outcome.get("result") is None:
+            return
+        error = f"Result could not be stored: {e}"
+    try:
+        _QUEUE.finish(task_id, lease_id, "failed", error=error)
+    except Exception as e:
+        _queue_error(e, task_id)
+
+
+def _execute_task(task: Dict[str, Any]) -> None:
+    """Run a leased task, renewing its lease until it finishes or is lost."""
+    assert _QUEUE is not None
+    task_id, lease_id = task["task_id"], task["lease_id"]
+    job = _Job(task_id)
+    done = threading.Event()
+
+    def _heartbeat() -> None:
+        while not done.wait(_QUEUE_HEARTBEAT_SECONDS):
+            try:
+                state = _QUEUE.heartbeat(task_id, lease_id, _QUEUE_VISIBILITY_SECONDS)
+            except Exception as e:
+                # Transient backend errors are survivable until the lease runs out
+                _queue_error(e, task_id)
+                continue
+            if state != "ok":
+                job.cancel("lease lost" if state == "lost" else "cancel requested")
+                return
+
+    threading.Thread(target=_heartbeat, name=f"heartbeat-{task_id}", daemon=True).start()
+    try:
+        fn, args = _task_call(task)
+        result = _run_job(job, fn, *args)
+    except HTTPException as e:
+        # Client errors (bad input, too large) fail the same way on every replica
+        _QUEUE_COUNTS["errors"] += 1
+        _finish_task(task_id, lease_id, "failed", error=f"{e.status_code}: {e.detail}", retry=e.status_code >= 500)
+    except Exception as e:
+        _QUEUE_COUNTS["errors"] += 1
+        _finish_task(task_id, lease_id, "failed", error=str(e), retry=True)
+    else:
+        status = "cancelled" if result.get("cancelled") else "done"
+        _QUEUE_COUNTS[status] += 1
+        _finish_task(task_id, lease_id, status, result=result, error=result.get("error"))
+    finally:
+        done.set()
+
+
+def _queue_puller() -> None:
+    """Background loop that leases queued tasks whenever this replica has a free slot."""
+    last_prune = 0.0
+    while True:
+        task = None
+        try:
+            if time.monotonic() - last_prune > 60:
+                # Marked first, so a failing prune is retried later rather than blocking leases
+                last_prune = time.monotonic()
+                _QUEUE.prune(time.time() - _QUEUE_RESULT_TTL_SECONDS)
+            if _has_free_slot():
+                task = _QUEUE.lease(_WORKER_ID, _QUEUE_VISIBILITY_SECONDS)
+        except Exception as e:
+            _queue_error(e)
+        if task is None:
+            time.sleep(_QUEUE_POLL_SECONDS)
+            continue
+        _QUEUE_COUNTS["leased"] += 1
+        try:
+            _execute_task(task)
+        except Exception as e:
+            # Whatever happened to this task, the replica keeps pulling work
+            _queue_error(e, task.get("task_id"))
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# HTTP Endpoints
+# ─────────────────────────────────────────────────────────────────────────────
+
+
+@app.on_event("startup")
+def _start_idle_evictor() -> None:
+    threading.Thread(target=_idle_evictor, name="idle-evictor", daemon=True).start()
+
+
+@app.on_event("startup")
+def _start_queue_pullers() -> None:
+    _build_queue()
+    if _QUEUE is None or not _truthy(os.getenv("SAM_QUEUE_PULL", "true")):
+        return
+    for i in range(max(1, int(os.getenv("SAM_QUEUE_WORKERS", "1")))):
+        threading.Thread(target=_queue_puller, name=f"queue-puller-{i}", daemon=True).start()
+
+
+@app.get("/health")
+def health():
+    return {
+        "ok": True,
+        "device": str(_DEVICE),
+        "model_loaded": any(lane.model is not None for lane in _LANES.values()),
+        "clap_loaded": _CLAP_RANKER is not None,
+        "sound_atlas_size": len(SOUND_ATLAS),
+        "default_variant": _DEFAULT_LANE,
+        "variants": [lane.status() for lane in _LANES.values()],
+        "clap_scheduler": _CLAP_SCHEDULER.status(),
+        "memory": _MEMORY.status(),
+        "jobs": {
+            "running": len(_JOBS),
+            "cancelled": _CANCEL_COUNTS["cancelled"],
+            "iterations_skipped": _CANCEL_COUNTS["iterations_skipped"],
+            "cancelled_by_reason": dict(_CANCEL_COUNTS["by_reason"]),
+            "cancelled_by_stage": dict(_CANCEL_COUNTS["by_stage"]),
+        },
+        "queue": _queue_status(),
+        "profiling": {
+            "sample_rate": _PROFILE_SAMPLE_RATE,
+            "armed": _PROFILE_STATE["armed"],
+            "captured": dict(_PROFILE_COUNTS),
+        },
+        "fingerprints": {
+            "entries": len(_FP_INDEX.rows),
+            "capacity": _FP_INDEX.capacity,
+            "matches": _FP_INDEX.matches,
+        },
+        "lifecycle": {
+            "idle_unload_seconds": _idle_unload_seconds(),
+            "idle_seconds": round(time.monotonic() - _LAST_USED, 1),
+            "inflight": _INFLIGHT,
+            **_LIFECYCLE_COUNTS,
+            "events": list(_LIFECYCLE_EVENTS),
+        },
+    }
+
+
+@app.post("/sam_audio/separate")
+async def sam_audio_separate(
+    request: Request,
+    authorization: Optional[str] = Header(default=None),
+    audio: UploadFile = File(...),
+    description: str = Form(default=""),
+    anchors_json: str = Form(default=""),
+    predict_spans: str = Form(default="false"),
+    reranking_candidates: str = Form(default="0"),
+    tier: str = Form(default=""),
+    latency_budget_ms: str = Form(default="0"),
+    deadline_ms: str = Form(default=""),
+    job_id: str = Form(default=""),
+    reuse: str = Form(default="true"),
+    x_request_deadline_ms: Optional[str] = Header(default=None),
+    x_job_id: Optional[str] = Header(default=None),
+    profile: str = Form(default="false"),
+    x_profile: Optional[str] = Header(default=None),
+) -> Dict[str, Any]:
+    """
+    Compatibility endpoint for the VocalX webapp:
+    - multipart fields: audio, description, anchors_json, predict_spans, reranking_candidates
+    - optional routing: tier ("fast" | "balanced" | "best"), latency_budget_ms
+    - optional deadline_ms (or X-Request-Deadline-Ms header): adapts reranking to fit
+    - optional job_id (or X-Job-Id header): lets /sam_audio/cancel/{job_id} stop it
+    - optional reuse (default true): serve the stored result of an earlier
+      upload of the same audio (even re-encoded) with the same parameters
+    - optional profile (or X-Profile header): capture a trace, see /sam_audio/profiles
+    - returns: { ok, target_wav_base64, residual_wav_base64, routing, settings, reuse, job_id }
+    """
+    started = time.monotonic()
+    _require_auth(authorization)
+
+    raw = await audio.read()
+    if not raw:
+        return {"ok": False, "error": "Empty file"}
+
+    # Model work is blocking; keep it off the event loop so lanes run concurrently
+    job = _Job(job_id or x_job_id or "", profile=_truthy(x_profile or profile))
+    return await _run_watched(
+        request,
+        [job],
+        _run_job,
+        job,
+        _run_separate,
+        raw,
+        audio.filename or "input",
+        description,
+        anchors_json,
+        _truthy(predict_spans),
+        int(reranking_candidates or 0),
+        tier,
+        float(latency_budget_ms or 0),
+        _request_deadline_ms(deadline_ms, x_request_deadline_ms),
+        started,
+        _truthy(reuse),
+    )
+
+
+def _predict_instances(
+    instances: List[Instance],
+    jobs: List[_Job],
+    deadline_header: Optional[str],
+    started: float,
+) -> Dict[str, Any]:
+    preds: List[Dict[str, Any]] = []
+
+    for inst, job in zip(instances, jobs):
+        if not inst.audio_b64:
+            preds.append({"ok": False, "error": "Missing audio_b64"})
+            continue
+
+        try:
+            raw = base64.b64decode(inst.audio_b64)
+            if not raw:
+                preds.append({"ok": False, "error": "Empty audio"})
+                continue
+
+            preds.append(
+                _run_job(
+                    job,
+                    _run_separate,
+                    raw,
+                    inst.filename,
+                    inst.description,
+                    inst.anchors_json,
+                    bool(inst.predict_spans),
+                    int(inst.reranking_candidates or 0),
+                    inst.tier,
+                    inst.latency_budget_ms,
+                    _request_deadline_ms(inst.deadline_ms, deadline_header),
+                    started,
+                    inst.reuse,
+                )
+            )
+
+        except Exception as e:
+            # One failed instance (no variant available, too large) must not abort the batch
+            preds.append({"ok": False, "error": str(e)})
+
+    return {"predictions": preds}
+
+
+@app.post("/predict")
+async def predict(
+    request: Request,
+    req: PredictRequest,
+    x_request_deadline_ms: Optional[str] = Header(default=None),
+) -> Dict[str, Any]:
+    """
+    Vertex AI prediction route.
+    Returns { "predictions": [ ... ] }.
+    """
+    started = time.monotonic()
+    jobs = [_Job(inst.job_id) for inst in req.instances]
+    return await _run_watched(
+        request, jobs, _predict_instances, req.instances, jobs, x_request_deadline_ms, started
+    )
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Instrument Disentangling Endpoints
+# ─────────────────────────────────────────────────────────────────────────────
+
+
+@app.post("/sam_audio/disentangle")
+async def sam_audio_disentangle(
+    request: Request,
+    authorization: Optional[str] = Header(default=None),
+    audio: UploadFile = File(...),
+    descriptions: str = Form(default=""),  # JSON array or empty for auto-detect
+    threshold: str = Form(default="0.2"),
+    top_k_fallback: str = Form(default="5"),
+    predict_spans: str = Form(default="true"),
+    reranking_candidates: str = Form(default="8"),
+    tier: str = Form(default=""),
+    latency_budget_ms: str = Form(default="0"),
+    deadline_ms: str = Form(default=""),
+    job_id: str = Form(default=""),
+    resume: str = Form(default="true"),
+    extend: str = Form(default="false"),
+    reuse: str = Form(default="true"),
+    x_request_deadline_ms: Optional[str] = Header(default=None),
+    x_job_id: Optional[str] = Header(default=None),
+    profile: str = Form(default="false"),
+    x_profile: Optional[str] = Header(default=None),
+) -> Dict[str, Any]:
+    """
+    Instrument disentangling endpoint for VocalX webapp.
+
+    Auto-detects instruments in audio using CLAP introspection against the
+    Sound Atlas (AudioSet ontology), then iteratively separates each detected
+    instrument.
+
+    Parameters:
+    - audio: Audio file (MP3/MP4/WAV/etc)
+    - descriptions: JSON array of descriptions to separate (optional).
+                    If empty, auto-detects using CLAP scoring.
+    - threshold: CLAP score threshold for auto-detection (0.0-1.0)
+    - top_k_fallback: Fallback to top N instruments if none above threshold
+    - predict_spans: Enable span prediction
+    - reranking_candidates: Number of reranking candidates
+    - tier: Optional SLA tier ("fast" | "balanced" | "best"); overrides
+            reranking_candidates and picks the model variant
+    - latency_budget_ms: Optional latency budget used to pick the tier
+    - deadline_ms: Optional deadline (or X-Request-Deadline-Ms header); each
+                   iteration adapts reranking/span prediction to fit it
+    - job_id: Optional id (or X-Job-Id header) for /sam_audio/cancel/{job_id}.
+              The job is also cancelled if the client disconnects.
+    - resume: Continue from a stored cascade of the same input whose
+              descriptions are a prefix of these (default true)
+    - extend: Treat descriptions as additional stems on top of the stored
+              cascade for this input (default false)
+    - reuse: Treat a near-duplicate of an earlier upload (same audio,
+             re-encoded) as that input for resume and introspection (default true)
+    - profile: Capture a torch.profiler + stack sample trace (or X-Profile header)
 
     Returns:
     {
-        "predictions": [
+        "ok": true/false,
+        "detected_instruments": [...],  # Descriptions selected for separation
+        "introspection_scores": {...},  # All CLAP scores (if auto-detected)
+        "tracks": [
             {
-                "ok": true/false,
-                "detected_instruments": [...],
-                "introspection_scores": {...},
-                "tracks": [...],
-                "residual_wav_base64": "...",
-                "error": "..."
+                "description": "...",
+                "wav_base64": "...",
+                "iteration": 0,
+                "settings": {...}  # predict_spans / reranking_candidates used
             },
             ...
-        ]
+        ],
+        "residual_wav_base64": "...",  # Final residual after all separations
+        "routing": {...},  # Variant and reranking depth actually used
+        "settings": {...},  # Deadline bookkeeping (deadline_ms, elapsed_ms, deadline_met)
+        "checkpoint": {"input_key": "...", "resumed_iterations": 2},
+        "reuse": {"input_key": "...", "match": "fingerprint", ...},
+        "job_id": "...",
+        "cancelled": true,  # Only if the job was cancelled
+        "error": "..."  # Only if ok=false
     }
     """
-    _ensure_loaded()
-    assert _MODEL is not None
-    assert _PROCESSOR is not None
-    assert _CLAP_RANKER is not None
+    started = time.monotonic()
+    _require_auth(authorization)
+
+    raw = await audio.read()
+    if not raw:
+        return {"ok": False, "error": "Empty file"}
+
+    try:
+        # Parse descriptions if provided
+        desc_list: List[str] = []
+        if descriptions and descriptions.strip():
+            desc_list = _json.loads(descriptions)
+
+        job = _Job(job_id or x_job_id or "", profile=_truthy(x_profile or profile))
+        return await _run_watched(
+            request,
+            [job],
+            _run_job,
+            job,
+            _run_disentangle,
+            raw,
+            audio.filename or "input",
+            desc_list,
+            float(threshold),
+            int(top_k_fallback),
+            _truthy(predict_spans),
+            int(reranking_candidates),
+            tier,
+            float(latency_budget_ms or 0),
+            _request_deadline_ms(deadline_ms, x_request_deadline_ms),
+            started,
+            _truthy(resume),
+            _truthy(extend),
+            _truthy(reuse),
+        )
 
+    except Exception as e:
+        return {"ok": False, "error": str(e)}
+
+
+def _predict_disentangle_instances(
+    instances: List[DisentangleInstance],
+    jobs: List[_Job],
+    deadline_header: Optional[str],
+    started: float,
+) -> Dict[str, Any]:
     preds: List[Dict[str, Any]] = []
 
-    for inst in req.instances:
+    for inst, job in zip(instances, jobs):
         if not inst.audio_b64:
             preds.append({"ok": False, "error": "Missing audio_b64"})
             continue
@@ -797,73 +3828,26 @@ def predict_disentangle(req: DisentangleRequest) -> Dict[str, Any]:
                 preds.append({"ok": False, "error": "Empty audio"})
                 continue
 
-            with tempfile.TemporaryDirectory() as td:
-                in_path = os.path.join(td, inst.filename or "input")
-                wav_path = os.path.join(td, "input.wav")
-                with open(in_path, "wb") as f:
-                    f.write(raw)
-                _to_wav_path(in_path, wav_path)
-
-                sr = int(getattr(_PROCESSOR, "audio_sampling_rate", 44100))
-
-                # Use provided descriptions or auto-detect
-                desc_list = inst.descriptions if inst.descriptions else []
-                introspection_scores: Dict[str, float] = {}
-
-                if not desc_list:
-                    # Load audio for introspection
-                    waveform, file_sr = torchaudio.load(wav_path)
-                    if file_sr != sr:
-                        waveform = torchaudio.functional.resample(waveform, file_sr, sr)
-                    audio_tensor = waveform.mean(0)
-
-                    desc_list, introspection_scores = _introspect_audio(
-                        audio_tensor=audio_tensor,
-                        sample_rate=sr,
-                        descriptions=SOUND_ATLAS,
-                        threshold=inst.threshold,
-                        top_k_fallback=inst.top_k_fallback,
-                    )
-
-                if not desc_list:
-                    preds.append({
-                        "ok": False,
-                        "error": "No instruments detected",
-                        "introspection_scores": introspection_scores,
-                    })
-                    continue
-
-                # Perform iterative separation
-                separated_tracks, final_residual, sr = _disentangle_audio(
-                    wav_path=wav_path,
-                    descriptions=desc_list,
-                    predict_spans=inst.predict_spans,
-                    reranking_candidates=inst.reranking_candidates,
+            preds.append(
+                _run_job(
+                    job,
+                    _run_disentangle,
+                    raw,
+                    inst.filename,
+                    inst.descriptions,
+                    inst.threshold,
+                    inst.top_k_fallback,
+                    inst.predict_spans,
+                    inst.reranking_candidates,
+                    inst.tier,
+                    inst.latency_budget_ms,
+                    _request_deadline_ms(inst.deadline_ms, deadline_header),
+                    started,
+                    inst.resume,
+                    inst.extend,
+                    inst.reuse,
                 )
-
-                # Encode tracks
-                tracks_output = []
-                for track in separated_tracks:
-                    wav_b64 = base64.b64encode(
-                        _write_wav_bytes(track["audio"], sr)
-                    ).decode("utf-8")
-                    tracks_output.append({
-                        "description": track["description"],
-                        "wav_base64": wav_b64,
-                        "iteration": track["iteration"],
-                    })
-
-                residual_b64 = base64.b64encode(
-                    _write_wav_bytes(final_residual, sr)
-                ).decode("utf-8")
-
-                preds.append({
-                    "ok": True,
-                    "detected_instruments": desc_list,
-                    "introspection_scores": introspection_scores,
-                    "tracks": tracks_output,
-                    "residual_wav_base64": residual_b64,
-                })
+            )
 
         except Exception as e:
             preds.append({"ok": False, "error": str(e)})
@@ -871,12 +3855,54 @@ def predict_disentangle(req: DisentangleRequest) -> Dict[str, Any]:
     return {"predictions": preds}
 
 
+@app.post("/predict/disentangle")
+async def predict_disentangle(
+    request: Request,
+    req: DisentangleRequest,
+    x_request_deadline_ms: Optional[str] = Header(default=None),
+) -> Dict[str, Any]:
+    """
+    Vertex AI prediction route for instrument disentangling.
+
+    Accepts batch of audio files for automatic instrument detection and
+    iterative separation.
+
+    Returns:
+    {
+        "predictions": [
+            {
+                "ok": true/false,
+                "detected_instruments": [...],
+                "introspection_scores": {...},
+                "tracks": [...],
+                "residual_wav_base64": "...",
+                "routing": {...},
+                "job_id": "...",
+                "error": "..."
+            },
+            ...
+        ]
+    }
+    """
+    started = time.monotonic()
+    jobs = [_Job(inst.job_id) for inst in req.instances]
+    return await _run_watched(
+        request, jobs, _predict_disentangle_instances, req.instances, jobs, x_request_deadline_ms, started
+    )
+
+
 @app.post("/sam_audio/introspect")
 async def sam_audio_introspect(
+    request: Request,
     authorization: Optional[str] = Header(default=None),
     audio: UploadFile = File(...),
     threshold: str = Form(default="0.0"),  # Return all scores by default
     top_k: str = Form(default="20"),
+    job_id: str = Form(default=""),
+    reuse: str = Form(default="true"),
+    x_job_id: Optional[str] = Header(default=None),
+    profile: str = Form(default="false"),
+    x_profile: Optional[str] = Header(default=None),
 ) -> Dict[str, Any]:
     """
     Introspection-only endpoint: Detect instruments in audio without separation.
@@ -888,59 +3914,178 @@ async def sam_audio_introspect(
     - audio: Audio file (MP3/MP4/WAV/etc)
     - threshold: Minimum score to include in results (default 0.0 = all)
     - top_k: Return only top K scoring instruments
+    - reuse: Return the stored scores of an earlier upload of the same audio
+    - profile: Capture a torch.profiler + stack sample trace (or X-Profile header)
 
     Returns:
     {
         "ok": true/false,
         "detected_instruments": [...],  # Above threshold or top-k
         "scores": {...},  # All instrument -> score mappings
+        "reuse": {...},  # Matched input_key and whether scores were reused
         "error": "..."
     }
     """
     _require_auth(authorization)
-    _ensure_loaded()
-    assert _CLAP_RANKER is not None
-    assert _PROCESSOR is not None
 
     raw = await audio.read()
     if not raw:
         return {"ok": False, "error": "Empty file"}
 
     try:
-        with tempfile.TemporaryDirectory() as td:
-            in_path = os.path.join(td, audio.filename or "input")
-            wav_path = os.path.join(td, "input.wav")
-            with open(in_path, "wb") as f:
-                f.write(raw)
-            _to_wav_path(in_path, wav_path)
-
-            sr = int(getattr(_PROCESSOR, "audio_sampling_rate", 44100))
-
-            # Load audio
-            waveform, file_sr = torchaudio.load(wav_path)
-            if file_sr != sr:
-                waveform = torchaudio.functional.resample(waveform, file_sr, sr)
-            audio_tensor = waveform.mean(0)
-
-            # Run introspection
-            selected, all_scores = _introspect_audio(
-                audio_tensor=audio_tensor,
-                sample_rate=sr,
-                descriptions=SOUND_ATLAS,
-                threshold=float(threshold),
-                top_k_fallback=int(top_k),
-            )
-
-            # Sort scores descending for readability
-            sorted_scores = dict(
-                sorted(all_scores.items(), key=lambda x: x[1], reverse=True)
-            )
-
-            return {
-                "ok": True,
-                "detected_instruments": selected,
-                "scores": sorted_scores,
-            }
+        job = _Job(job_id or x_job_id or "", profile=_truthy(x_profile or profile))
+        return await _run_watched(
+            request,
+            [job],
+            _run_job,
+            job,
+            _run_introspect,
+            raw,
+            audio.filename or "input",
+            float(threshold),
+            int(top_k),
+            _truthy(reuse),
+        )
 
     except Exception as e:
         return {"ok": False, "error": str(e)}
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Job Control
+# ─────────────────────────────────────────────────────────────────────────────
+
+
+@app.post("/sam_audio/cancel/{job_id}")
+def sam_audio_cancel(
+    job_id: str,
+    authorization: Optional[str] = Header(default=None),
+) -> Dict[str, Any]:
+    """
+    Cancel an in-flight job by the job_id it was submitted with.
+
+    Cancellation is cooperative: the job stops at its next checkpoint (lane
+    queue, rerank round, cascade iteration or before encoding) and its
+    request returns { ok: false, cancelled: true }.
+    """
+    _require_auth(authorization)
+    with _JOBS_LOCK:
+        job = _JOBS.get(job_id)
+    if job is None:
+        # A queued task may be pending, or leased by another replica
+        status = _QUEUE.cancel(job_id) if _QUEUE is not None else None
+        if status in ("cancelled", "leased"):
+            return {"ok": True, "job_id": job_id, "status": status}
+        return {"ok": False, "error": "Unknown or already finished job"}
+    job.cancel("cancel requested")
+    return {"ok": True, "job_id": job_id}
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Shared Task Queue Endpoints
+# ─────────────────────────────────────────────────────────────────────────────
+
+
+@app.post("/sam_audio/queue")
+def sam_audio_queue_submit(
+    req: QueueSubmitRequest,
+    authorization: Optional[str] = Header(default=None),
+) -> Dict[str, Any]:
+    """
+    Queue a separate or disentangle task for whichever replica is free.
+
+    Body: { "kind": "separate" | "disentangle", "instance": {...} } where
+    instance has the fields of a /predict or /predict/disentangle instance.
+    Its job_id, if set, becomes the task_id.
+
+    Returns: { ok, task_id, status }. Poll GET /sam_audio/queue/{task_id}.
+    """
+    _require_auth(authorization)
+    if _QUEUE is None:
+        raise HTTPException(status_code=503, detail="Task queue is disabled; set SAM_QUEUE_BACKEND")
+    if req.kind not in ("separate", "disentangle"):
+        raise HTTPException(status_code=400, detail=f"Unknown task kind {req.kind!r}; use separate or disentangle")
+
+    model = Instance if req.kind == "separate" else DisentangleInstance
+    try:
+        inst = model(**req.instance)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    raw = base64.b64decode(inst.audio_b64)
+    if not raw:
+        return {"ok": False, "error": "Empty audio"}
+
+    task_id = inst.job_id or uuid.uuid4().hex
+    try:
+        _QUEUE.submit(task_id, req.kind, inst.model_dump(exclude={"audio_b64"}), raw)
+    except _TaskExists:
+        raise HTTPException(status_code=409, detail=f"Task {task_id} already exists")
+    return {"ok": True, "task_id": task_id, "status": "pending"}
+
+
+@app.get("/sam_audio/queue/{task_id}")
+def sam_audio_queue_status(
+    task_id: str,
+    authorization: Optional[str] = Header(default=None),
+) -> Dict[str, Any]:
+    """
+    Status of a queued task:
+    { ok, task_id, kind, status, attempts, leased_by, submitted_at, updated_at, error,
+      result }. `result` is the separate/disentangle response once status is done.
+    """
+    _require_auth(authorization)
+    if _QUEUE is None:
+        raise HTTPException(status_code=503, detail="Task queue is disabled; set SAM_QUEUE_BACKEND")
+    task = _QUEUE.get(task_id)
+    if task is None:
+        raise HTTPException(status_code=404, detail=f"Unknown task {task_id}")
+    return {"ok": True, **task}
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Profiling Endpoints
+# ─────────────────────────────────────────────────────────────────────────────
+
+
+@app.get("/sam_audio/profiles")
+def sam_audio_profiles(authorization: Optional[str] = Header(default=None)) -> Dict[str, Any]:
+    """
+    List stored traces, newest first:
+    { ok, traces: [{ trace_id, job_id, handler, reason, started_at, elapsed_ms,
+      stack_samples, size_bytes }], armed, sample_rate }
+    """
+    _require_auth(authorization)
+    return {
+        "ok": True,
+        "traces": _list_traces(),
+        "armed": _PROFILE_STATE["armed"],
+        "sample_rate": _PROFILE_SAMPLE_RATE,
+    }
+
+
+@app.post("/sam_audio/profiles/arm")
+def sam_audio_profiles_arm(
+    authorization: Optional[str] = Header(default=None),
+    count: str = Form(default="1"),
+) -> Dict[str, Any]:
+    """Profile the next `count` jobs, whichever route or queue they arrive through."""
+    _require_auth(authorization)
+    with _PROFILE_STATE_LOCK:
+        _PROFILE_STATE["armed"] = max(0, int(count))
+    return {"ok": True, "armed": _PROFILE_STATE["armed"]}
+
+
+@app.get("/sam_audio/profiles/{trace_id}")
+def sam_audio_profile_download(
+    trace_id: str,
+    authorization: Optional[str] = Header(default=None),
+) -> FileResponse:
+    """Download a trace in Chrome trace format (chrome://tracing, Perfetto)."""
+    _require_auth(authorization)
+    if trace_id not in {meta["trace_id"] for meta in _list_traces()}:
+        raise HTTPException(status_code=404, detail=f"Unknown trace {trace_id}")
+    return FileResponse(
+        os.path.join(_profile_root(), f"{trace_id}.json"),
+        media_type="application/json",
+        filename=f"sam-audio-{trace_id}.json",
+    )
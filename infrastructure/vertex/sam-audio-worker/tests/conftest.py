@@ -0,0 +1,47 @@
+"""
+Shared setup: put the worker on sys.path and stand in for the model packages
+when they are not installed, so the tests run without GPU images or gated
+weights. The stand-ins only satisfy app.py's imports; a test that reaches a
+model load fails loudly instead of downloading anything.
+"""
+
+import importlib.util
+import os
+import sys
+import types
+
+import pytest
+
+pytest.importorskip("torch")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("SAM_WEIGHT_CACHE_DIR", "")
+os.environ.setdefault("SAM_CHECKPOINT_DIR", "")
+
+
+def _unavailable(name):
+    def from_pretrained(cls, *args, **kwargs):
+        raise RuntimeError(f"{name} is stubbed in tests")
+
+    return type(name, (), {"from_pretrained": classmethod(from_pretrained)})
+
+
+def _stub(name, **attrs):
+    module = types.ModuleType(name)
+    module.__dict__.update(attrs)
+    sys.modules[name] = module
+    parent, _, child = name.rpartition(".")
+    if parent:
+        setattr(sys.modules[parent], child, module)
+    return module
+
+
+if importlib.util.find_spec("sam_audio") is None:
+    _stub("sam_audio", SAMAudio=_unavailable("SAMAudio"), SAMAudioProcessor=_unavailable("SAMAudioProcessor"))
+    _stub("sam_audio.model")
+    _stub("sam_audio.model.config", ClapRankerConfig=_unavailable("ClapRankerConfig"))
+    _stub("sam_audio.ranking")
+    _stub("sam_audio.ranking.clap", ClapRanker=_unavailable("ClapRanker"))
+
+if importlib.util.find_spec("torchaudio") is None:
+    _stub("torchaudio")
+    _stub("torchaudio.functional")
@@ -0,0 +1,35 @@
+"""
+Window layout for chunked separation (_chunk_windows).
+
+    cd infrastructure/vertex/sam-audio-worker && python -m pytest tests
+"""
+
+import pytest
+
+import app as worker
+
+
+@pytest.mark.parametrize("overlap", [0.0, 1.0])
+@pytest.mark.parametrize("duration_s,chunk_s", [(10.0, 30.0), (60.0, 30.0), (61.0, 30.0), (600.0, 47.5), (30.0, 30.0)])
+def test_windows_cover_input_with_fixed_overlap(monkeypatch, overlap, duration_s, chunk_s):
+    monkeypatch.setattr(worker, "_CHUNK_OVERLAP_SECONDS", overlap)
+    windows = worker._chunk_windows(duration_s, chunk_s)
+
+    assert windows[0][0] == 0.0
+    assert windows[-1][1] == pytest.approx(duration_s)
+    lengths = [end - start for start, end in windows]
+    assert max(lengths) <= chunk_s + 1e-9
+    assert max(lengths) == pytest.approx(min(lengths))
+    for (_, prev_end), (start, _) in zip(windows, windows[1:]):
+        assert prev_end - start == pytest.approx(overlap)
+    # One window fewer would have to be longer than chunk_s
+    if len(windows) > 1:
+        assert (duration_s - overlap) / (len(windows) - 1) + overlap > chunk_s
+
+
+def test_window_length_maps_back_to_same_windows(monkeypatch):
+    # The memory plan sizes chunks, then the separation recomputes windows from that size
+    monkeypatch.setattr(worker, "_CHUNK_OVERLAP_SECONDS", 1.0)
+    windows = worker._chunk_windows(613.7, 41.0)
+    start, end = windows[0]
+    assert worker._chunk_windows(613.7, end - start) == windows
@@ -0,0 +1,108 @@
+"""
+A client that disconnects mid-request cancels its job.
+
+The app is driven through its raw ASGI interface so the test controls exactly
+when the server reports `http.disconnect`. Model work is replaced by a loop of
+cancellation checkpoints; everything else (routing, the disconnect watch in
+_run_watched, _run_job) is the real code path.
+
+    cd infrastructure/vertex/sam-audio-worker && python -m pytest tests
+"""
+
+import asyncio
+import json
+import threading
+import time
+
+import app as worker
+
+BOUNDARY = "sam-audio-test-boundary"
+
+
+def _multipart(fields, filename, payload):
+    parts = []
+    for name, value in fields.items():
+        parts.append(
+            f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode()
+        )
+    parts.append(
+        f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="audio"; filename="{filename}"\r\n'
+        f"Content-Type: application/octet-stream\r\n\r\n".encode()
+        + payload
+        + b"\r\n"
+    )
+    parts.append(f"--{BOUNDARY}--\r\n".encode())
+    return b"".join(parts)
+
+
+async def _post_then_disconnect(path, body, started, timeout_s=10.0):
+    """POST `body`, report a disconnect once `started` is set, return (status, json)."""
+    disconnected = asyncio.Event()
+    delivered = False
+    messages = []
+
+    async def receive():
+        nonlocal delivered
+        if not delivered:
+            delivered = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        await disconnected.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "POST",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": b"",
+        "root_path": "",
+        "headers": [
+            (b"content-type", f"multipart/form-data; boundary={BOUNDARY}".encode()),
+            (b"content-length", str(len(body)).encode()),
+        ],
+        "client": ("127.0.0.1", 12345),
+        "server": ("testserver", 80),
+    }
+    call = asyncio.create_task(worker.app(scope, receive, send))
+    loop = asyncio.get_running_loop()
+    assert await loop.run_in_executor(None, started.wait, timeout_s), "job never started"
+    disconnected.set()
+    await asyncio.wait_for(call, timeout_s)
+
+    status = next(m["status"] for m in messages if m["type"] == "http.response.start")
+    payload = b"".join(m.get("body", b"") for m in messages if m["type"] == "http.response.body")
+    return status, json.loads(payload)
+
+
+def test_disconnect_cancels_running_job(monkeypatch):
+    started = threading.Event()
+    seen = {}
+
+    def fake_separate(*args, job=None, **kwargs):
+        seen["job"] = job
+        started.set()
+        deadline = time.monotonic() + 10.0
+        while time.monotonic() < deadline:
+            worker._checkpoint(job, "test")
+            time.sleep(0.02)
+        return {"ok": True}
+
+    monkeypatch.setattr(worker, "_run_separate", fake_separate)
+    before = worker._CANCEL_COUNTS["by_reason"]["client disconnected"]
+
+    body = _multipart({"description": "drums", "job_id": "disconnect-test"}, "a.wav", b"RIFF")
+    status, result = asyncio.run(_post_then_disconnect("/sam_audio/separate", body, started))
+
+    assert status == 200
+    assert result["ok"] is False
+    assert result["cancelled"] is True
+    assert result["job_id"] == "disconnect-test"
+    assert seen["job"].reason == "client disconnected"
+    assert worker._CANCEL_COUNTS["by_reason"]["client disconnected"] == before + 1
+    assert worker._INFLIGHT == 0
@@ -0,0 +1,32 @@
+"""
+In-memory WAV encoding of stems (_wav_bytes).
+
+    cd infrastructure/vertex/sam-audio-worker && python -m pytest tests
+"""
+
+import io
+import struct
+
+import numpy as np
+import pytest
+import soundfile
+
+import app as worker
+
+
+@pytest.mark.parametrize("channels,frames", [(1, 44100), (2, 1234), (1, 0)])
+def test_wav_bytes_round_trips(channels, frames):
+    pcm = np.random.default_rng(0).uniform(-1, 1, (channels, frames)).astype(np.float32)
+    data = worker._wav_bytes(pcm, 44100)
+
+    # RIFF size covers everything after its own header
+    assert data[:4] == b"RIFF" and data[8:12] == b"WAVE"
+    assert struct.unpack("<I", data[4:8])[0] == len(data) - 8
+
+    info = soundfile.info(io.BytesIO(data))
+    assert info.samplerate == 44100
+    assert info.channels == channels
+    assert info.frames == frames
+    assert info.subtype == "FLOAT"
+    decoded, _ = soundfile.read(io.BytesIO(data), dtype="float32", always_2d=True)
+    np.testing.assert_array_equal(decoded.T, pcm)
@@ -0,0 +1,110 @@
+"""
+Task state transitions of the SQLite queue backend: lease, expiry, retry,
+cancel and result storage.
+
+    cd infrastructure/vertex/sam-audio-worker && python -m pytest tests
+"""
+
+import os
+
+import pytest
+
+import app as worker
+
+
+@pytest.fixture
+def queue(tmp_path, monkeypatch):
+    monkeypatch.setattr(worker, "_QUEUE_MAX_ATTEMPTS", 2)
+    monkeypatch.setattr(worker, "_retry_delay", lambda attempts: 0.0)
+    return worker._SQLiteQueue(str(tmp_path / "queue.db"))
+
+
+def test_lease_and_finish(queue):
+    queue.submit("t1", "separate", {"description": "drums"}, b"RIFF")
+    with pytest.raises(worker._TaskExists):
+        queue.submit("t1", "separate", {}, b"")
+
+    task = queue.lease("w1", 60)
+    assert task["task_id"] == "t1"
+    assert task["params"] == {"description": "drums"}
+    assert task["audio"] == b"RIFF"
+    assert task["attempts"] == 1
+    # A live lease hides the task from other replicas
+    assert queue.lease("w2", 60) is None
+    assert queue.heartbeat("t1", task["lease_id"], 60) == "ok"
+
+    assert queue.finish("t1", task["lease_id"], "done", result={"ok": True})
+    row = queue.get("t1")
+    assert row["status"] == "done"
+    assert row["result"] == {"ok": True}
+    assert queue.counts() == {"done": 1}
+
+
+def test_expired_lease_is_taken_over(queue):
+    queue.submit("t1", "separate", {}, b"")
+    first = queue.lease("w1", -1)
+    second = queue.lease("w2", 60)
+    assert second["task_id"] == "t1"
+    assert second["attempts"] == 2
+    assert queue.get("t1")["leased_by"] == "w2"
+
+    # The replica that lost the lease can no longer extend or finish it
+    assert queue.heartbeat("t1", first["lease_id"], 60) == "lost"
+    assert not queue.finish("t1", first["lease_id"], "done", result={"ok": True})
+    assert queue.get("t1")["status"] == "leased"
+    assert os.listdir(queue.results_dir) == []
+
+
+def test_expired_last_attempt_fails(queue):
+    queue.submit("t1", "separate", {}, b"")
+    queue.lease("w1", -1)
+    queue.lease("w2", -1)
+    assert queue.lease("w3", 60) is None
+    row = queue.get("t1")
+    assert row["status"] == "failed"
+    assert row["error"] == "Lease expired after 2 attempts"
+
+
+def test_retry_until_attempts_run_out(queue):
+    queue.submit("t1", "separate", {}, b"")
+    task = queue.lease("w1", 60)
+    assert queue.finish("t1", task["lease_id"], "failed", error="boom", retry=True)
+    row = queue.get("t1")
+    assert row["status"] == "pending"
+    assert row["error"] == "boom"
+
+    task = queue.lease("w1", 60)
+    assert task["attempts"] == 2
+    assert queue.finish("t1", task["lease_id"], "failed", error="boom again", retry=True)
+    row = queue.get("t1")
+    assert row["status"] == "failed"
+    assert row["error"] == "boom again"
+
+
+def test_cancel_pending_and_leased(queue):
+    queue.submit("pending", "separate", {}, b"")
+    assert queue.cancel("pending") == "cancelled"
+    assert queue.lease("w1", 60) is None
+    assert queue.cancel("missing") is None
+
+    queue.submit("leased", "separate", {}, b"")
+    task = queue.lease("w1", 60)
+    # A running task is only flagged; its replica sees the flag on the next heartbeat
+    assert queue.cancel("leased") == "leased"
+    assert queue.heartbeat("leased", task["lease_id"], 60) == "cancelled"
+    # ...and a flagged task is not retried
+    assert queue.finish("leased", task["lease_id"], "cancelled", error="cancel requested", retry=True)
+    assert queue.get("leased")["status"] == "cancelled"
+
+
+def test_prune_deletes_result_files(queue):
+    queue.submit("t1", "separate", {}, b"")
+    task = queue.lease("w1", 60)
+    queue.finish("t1", task["lease_id"], "done", result={"ok": True})
+    assert len(os.listdir(queue.results_dir)) == 1
+
+    queue.prune(older_than=0)
+    assert queue.get("t1") is not None
+    queue.prune(older_than=float("inf"))
+    assert queue.get("t1") is None
+    assert os.listdir(queue.results_dir) == []
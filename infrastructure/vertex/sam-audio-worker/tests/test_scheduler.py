@@ -0,0 +1,74 @@
+"""
+Weighted fair queuing across priority classes in _FairScheduler.
+
+    cd infrastructure/vertex/sam-audio-worker && python -m pytest tests
+"""
+
+import threading
+import time
+
+import app as worker
+
+INTERACTIVE = worker.PRIORITY_INTERACTIVE
+BATCH = worker.PRIORITY_BATCH
+
+
+def _grant_order(scheduler, arrivals):
+    """
+    Queue `arrivals` ((class, label) pairs, in that order) behind a held slot,
+    then release it and return the labels in the order their slots were granted.
+    """
+    granted = []
+
+    def wait(priority, label):
+        with scheduler.slot(priority):
+            granted.append(label)
+
+    scheduler.acquire(INTERACTIVE)
+    threads = []
+    for priority, label in arrivals:
+        depth = scheduler.waiting()
+        thread = threading.Thread(target=wait, args=(priority, label))
+        thread.start()
+        threads.append(thread)
+        deadline = time.monotonic() + 5.0
+        while scheduler.waiting() == depth:
+            assert time.monotonic() < deadline, "waiter never queued"
+            time.sleep(0.001)
+    scheduler.release()
+    for thread in threads:
+        thread.join(5.0)
+    return granted
+
+
+def test_weighted_share_while_both_classes_wait(monkeypatch):
+    monkeypatch.setitem(worker._PRIORITY_WEIGHTS, INTERACTIVE, 4.0)
+    monkeypatch.setitem(worker._PRIORITY_WEIGHTS, BATCH, 1.0)
+    scheduler = worker._FairScheduler("test", 1)
+
+    arrivals = [(BATCH, f"b{i}") for i in range(3)] + [(INTERACTIVE, f"i{i}") for i in range(8)]
+    granted = _grant_order(scheduler, arrivals)
+
+    # Batch got every fifth slot, and each class was served FIFO
+    assert granted == ["b0", "i0", "i1", "i2", "i3", "b1", "i4", "i5", "i6", "i7", "b2"]
+    status = scheduler.status()
+    assert status["active"] == 0
+    assert status["classes"][INTERACTIVE]["granted"] == 9
+    assert status["classes"][BATCH]["granted"] == 3
+
+
+def test_idle_class_does_not_bank_credit(monkeypatch):
+    monkeypatch.setitem(worker._PRIORITY_WEIGHTS, INTERACTIVE, 4.0)
+    monkeypatch.setitem(worker._PRIORITY_WEIGHTS, BATCH, 1.0)
+    scheduler = worker._FairScheduler("test", 1)
+
+    # Interactive runs alone for a while; batch service stays at zero meanwhile
+    for _ in range(20):
+        with scheduler.slot(INTERACTIVE):
+            pass
+
+    arrivals = [(BATCH, f"b{i}") for i in range(3)] + [(INTERACTIVE, f"i{i}") for i in range(8)]
+    granted = _grant_order(scheduler, arrivals)
+
+    # Batch catches up to the current virtual time, not to its idle history
+    assert granted == ["b0", "i0", "i1", "i2", "i3", "b1", "i4", "i5", "i6", "i7", "b2"]